@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# SVNAdmin plugin
+"""Benchmark of SVNAdmin repository, SVN user and authz operations.
+
+Synthetic data are generated in a temporary directory for every
+combination of sizes: a parent path with N small FSFS repositories
+(copies of one repository made by `svnadmin create`), an htpasswd file
+with M users and an authz file with K rules. Operations are run against
+a Trac `EnvironmentStub` and timed; the result is written as JSON report.
+
+Only the Subversion command line tools are needed:
+
+    python bench/bench_svnadmin.py --repos 10,100 --users 1000,10000 \\
+        --rules 100,1000 --output report.json
+
+Reports of two runs are compared with:
+
+    python bench/bench_svnadmin.py --compare old.json new.json
+"""
+
+import json
+import optparse
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trac.test import EnvironmentStub
+
+from svnadmin.api import SvnAdmin, SvnRepositoryProvider
+from svnadmin.authz import SvnAuthzManager
+from svnadmin.htpasswd import hash_password
+
+
+REPORT_VERSION = 1
+
+
+def _sizes(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def _svn_version(svnadmin):
+    try:
+        process = subprocess.Popen((svnadmin, '--version', '--quiet'),
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        return process.communicate()[0].strip() or None
+    except OSError:
+        return None
+
+
+class Benchmark(object):
+
+    def __init__(self, options):
+        self.options = options
+        self.results = []
+
+    # Timing
+
+    def measure(self, operation, params, fn, setup=None, repeat=None):
+        """Run `fn` `repeat` times (calling `setup` before each run,
+        untimed) and store duration statistics."""
+        repeat = repeat or self.options.repeat
+        durations = []
+        for i in xrange(repeat):
+            if setup is not None:
+                setup(i)
+            start = time.time()
+            fn(i)
+            durations.append(time.time() - start)
+        durations.sort()
+        result = {
+            'operation': operation,
+            'params': params,
+            'runs': repeat,
+            'min': durations[0],
+            'median': durations[len(durations) // 2],
+            'mean': sum(durations) / len(durations),
+            'max': durations[-1],
+        }
+        self.results.append(result)
+        if not self.options.quiet:
+            print '%-28s %-36s median %9.3f ms  min %9.3f ms' % (
+                operation, ' '.join('%s=%s' % item
+                                    for item in sorted(params.iteritems())),
+                result['median'] * 1000, result['min'] * 1000)
+        return result
+
+    def check(self, error):
+        """Fail on error string returned by `SvnAdmin` methods."""
+        if error:
+            raise RuntimeError(error)
+
+    # Synthetic data
+
+    def make_template(self, workdir):
+        template = os.path.join(workdir, 'template')
+        subprocess.check_call((self.options.svnadmin, 'create', template))
+        return template
+
+    def make_parent_path(self, workdir, template, num):
+        parentpath = os.path.join(workdir, 'repos-%d' % num)
+        os.mkdir(parentpath)
+        for i in xrange(num):
+            shutil.copytree(template,
+                            os.path.join(parentpath, 'repo%06d' % i),
+                            symlinks=True)
+        return parentpath
+
+    def make_passwd(self, workdir, num):
+        path = os.path.join(workdir, 'passwd-%d' % num)
+        hash = hash_password('secret', 'sha1')
+        fp = open(path, 'wb')
+        try:
+            for i in xrange(num):
+                fp.write('user%07d:%s\n' % (i, hash))
+        finally:
+            fp.close()
+        return path
+
+    def make_authz(self, workdir, num, num_repos):
+        path = os.path.join(workdir, 'authz-%d' % num)
+        lines = ['[groups]']
+        num_groups = max(1, num // 20)
+        for g in xrange(num_groups):
+            members = ['user%07d' % (g * 10 + u) for u in xrange(10)]
+            lines.append('group%d = %s' % (g, ', '.join(members)))
+        lines.append('')
+        lines.append('[/]')
+        lines.append('* = r')
+        # rules are spread over sections with 10 rules each
+        for r in xrange(num):
+            if r % 10 == 0:
+                lines.append('')
+                lines.append('[repo%06d:/trunk/dir%d]'
+                             % ((r // 10) % max(1, num_repos), r // 10))
+            if r % 2:
+                lines.append('@group%d = rw' % (r % num_groups))
+            else:
+                lines.append('user%07d = %s' % (r, r % 3 and 'r' or 'rw'))
+        fp = open(path, 'wb')
+        try:
+            fp.write('\n'.join(lines) + '\n')
+        finally:
+            fp.close()
+        return path
+
+    def make_env(self, parentpath, passwd, authz):
+        env = EnvironmentStub(enable=['trac.*', 'svnadmin.*'])
+        env.config.set('svnadmin', 'parent_path', parentpath)
+        options = self.options
+        env.config.set('svnadmin', 'svnadmin_location', options.svnadmin)
+        env.config.set('svnadmin', 'svn_client_location', options.svn)
+        env.config.set('svnadmin', 'svnlook_location', options.svnlook)
+        env.config.set('svnadmin', 'backend', options.backend)
+        env.config.set('svnadmin', 'passwd_path', passwd)
+        env.config.set('svnadmin', 'htpasswd_backend', 'builtin')
+        env.config.set('trac', 'authz_file', authz)
+        return env
+
+    # Benchmarks
+
+    def bench_repositories(self, env, num):
+        provider = env[SvnRepositoryProvider]
+        params = {'repos': num}
+
+        def invalidate(i):
+            provider.invalidate_cache()
+            for name in provider.get_repository_names():
+                provider.invalidate_cache(name)
+            provider.invalidate_cache()
+        self.measure('get_repositories (cold)', params,
+                     lambda i: list(provider.get_repositories()),
+                     setup=invalidate)
+        self.measure('get_repositories (warm)', params,
+                     lambda i: list(provider.get_repositories()))
+        self.measure('add_repository', params,
+                     lambda i: provider.add_repository('bench%d' % i))
+        self.measure('remove_repository', params,
+                     lambda i: provider.remove_repository('bench%d' % i))
+
+    def bench_users(self, env, num):
+        svnadmin = env[SvnAdmin]
+        params = {'users': num}
+        svnadmin.invalidate_cache()
+        self.measure('set_password (change)', params,
+                     lambda i: self.check(svnadmin.set_password(
+                         'user%07d' % (i % num), 'changed')))
+        self.measure('set_password (add)', params,
+                     lambda i: self.check(svnadmin.set_password(
+                         'bench%d' % i, 'new')))
+        self.measure('delete_user', params,
+                     lambda i: self.check(svnadmin.delete_user('bench%d' % i)))
+        self.measure('find_users', params,
+                     lambda i: svnadmin.find_users('user00', limit=100))
+
+    def bench_authz(self, env, num):
+        manager = env[SvnAuthzManager]
+        params = {'rules': num}
+        self.measure('authz load', params, lambda i: manager.get_authz(),
+                     setup=lambda i: manager.invalidate_cache())
+        self.measure('authz load + compile', params,
+                     lambda i: manager.get_evaluator(),
+                     setup=lambda i: manager.invalidate_cache())
+        evaluator = manager.get_evaluator()
+        self.measure('authz get_permission', params,
+                     lambda i: evaluator.get_permission(
+                         'user%07d' % i, 'repo000000', '/trunk/dir0/file'))
+        text = str(manager.get_authz())
+        self.measure('authz save_text', params,
+                     lambda i: manager.save_text(text))
+        self.measure('authz add_rule', params,
+                     lambda i: manager.add_rule('/bench', 'bench%d' % i, 'r'))
+
+    def run(self):
+        options = self.options
+        workdir = tempfile.mkdtemp(prefix='svnadmin-bench-')
+        try:
+            template = self.make_template(workdir)
+            for num in options.repos:
+                parentpath = self.make_parent_path(workdir, template, num)
+                env = self.make_env(parentpath, os.path.join(workdir, 'p'),
+                                    os.path.join(workdir, 'a'))
+                self.bench_repositories(env, num)
+                shutil.rmtree(parentpath, ignore_errors=True)
+            for num in options.users:
+                passwd = self.make_passwd(workdir, num)
+                env = self.make_env(workdir, passwd, os.path.join(workdir, 'a'))
+                self.bench_users(env, num)
+            for num in options.rules:
+                authz = self.make_authz(workdir, num, max(options.repos or [1]))
+                env = self.make_env(workdir, os.path.join(workdir, 'p'), authz)
+                self.bench_authz(env, num)
+        finally:
+            if options.keep:
+                print 'Data kept in %s' % workdir
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        return {
+            'version': REPORT_VERSION,
+            'time': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'svn': _svn_version(options.svnadmin),
+            'backend': options.backend,
+            'repeat': options.repeat,
+            'results': self.results,
+        }
+
+
+def compare(old_path, new_path):
+    """Print median ratios of operations present in both reports."""
+    def load(path):
+        fp = open(path, 'rb')
+        try:
+            report = json.load(fp)
+        finally:
+            fp.close()
+        return dict(((r['operation'], tuple(sorted(r['params'].items()))), r)
+                    for r in report['results'])
+    old, new = load(old_path), load(new_path)
+    for key in sorted(set(old) & set(new)):
+        operation, params = key
+        ratio = new[key]['median'] / old[key]['median'] \
+                if old[key]['median'] else float('inf')
+        print '%-28s %-20s %9.3f ms -> %9.3f ms  x%.2f' % (
+            operation, ' '.join('%s=%s' % item for item in params),
+            old[key]['median'] * 1000, new[key]['median'] * 1000, ratio)
+
+
+def main(args=None):
+    parser = optparse.OptionParser(usage='%prog [options]\n'
+                                         '       %prog --compare OLD NEW')
+    parser.add_option('--repos', default='10,100',
+                      help='comma separated numbers of repositories')
+    parser.add_option('--users', default='1000,10000',
+                      help='comma separated numbers of SVN users')
+    parser.add_option('--rules', default='100,1000',
+                      help='comma separated numbers of authz rules')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='number of runs of every operation')
+    parser.add_option('--backend', default='subprocess',
+                      choices=['auto', 'bindings', 'subprocess'],
+                      help='backend for Subversion operations')
+    parser.add_option('--svnadmin', default='svnadmin')
+    parser.add_option('--svn', default='svn')
+    parser.add_option('--svnlook', default='svnlook')
+    parser.add_option('-o', '--output', help='write JSON report to file')
+    parser.add_option('--keep', action='store_true',
+                      help='keep generated data')
+    parser.add_option('-q', '--quiet', action='store_true')
+    parser.add_option('--compare', action='store_true',
+                      help='compare two JSON reports')
+    options, args = parser.parse_args(args)
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error('--compare requires two reports')
+        compare(*args)
+        return 0
+
+    options.repos = _sizes(options.repos)
+    options.users = _sizes(options.users)
+    options.rules = _sizes(options.rules)
+    report = Benchmark(options).run()
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        fp = open(options.output, 'wb')
+        try:
+            fp.write(data + '\n')
+        finally:
+            fp.close()
+    elif options.quiet:
+        print data
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
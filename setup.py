@@ -30,6 +30,13 @@ setup(
         svnadmin.acct_mgr_listener = svnadmin.acct_mgr_listener
         svnadmin.admin = svnadmin.admin
         svnadmin.api = svnadmin.api
+        svnadmin.authz = svnadmin.authz
+        svnadmin.db = svnadmin.db
+        svnadmin.replication = svnadmin.replication
+        svnadmin.stats = svnadmin.stats
+        svnadmin.timing = svnadmin.timing
+        svnadmin.verification = svnadmin.verification
+        svnadmin.watcher = svnadmin.watcher
     """,
     package_data = {
     	'svnadmin': [
@@ -1,7 +1,16 @@
+import time
+
+from trac.admin import AdminCommandError, IAdminCommandProvider
 from trac.core import Component, implements
+from trac.util.text import printout
 
-from acct_mgr.api import IAccountChangeListener
+from acct_mgr.api import AccountManager, IAccountChangeListener
+from acct_mgr.db import SessionStore
+from acct_mgr.htfile import HtPasswdStore
+from acct_mgr.pwhash import HtPasswdHashMethod
 from svnadmin.api import SvnAdmin
+from svnadmin.htpasswd import HtpasswdFile
+from svnadmin.replication import SvnReplicationQueue
 
 
 
@@ -11,29 +20,42 @@ class AccountManagerToSVNReplication(Component):
     replication into SVN password file.
     """
 
-    implements(IAccountChangeListener)
+    implements(IAccountChangeListener, IAdminCommandProvider)
 
     def __init__(self):
         self.svnadmin = SvnAdmin(self.env)
+        self.queue = SvnReplicationQueue(self.env)
 
     # IAccountChangeListener
 
     def user_created(self, user, password):
         """User created"""
-        res = self.svnadmin.set_password(user, password)
-        self.log.info("AccountManagerToSVNReplication: user_created: %s, %s" % (user, res or 'OK'))
+        if self.queue.is_async():
+            self.queue.enqueue_password(user, password)
+            res = None
+        else:
+            res = self.svnadmin.set_password(user, password)
+        self.log.info("AccountManagerToSVNReplication: user_created: %s, %s" % (user, res or self._ok()))
         return res
 
     def user_password_changed(self, user, password):
         """Password changed"""
-        res = self.svnadmin.set_password(user, password)
-        self.log.info("AccountManagerToSVNReplication: user_password_changed: %s, %s" % (user, res or 'OK'))
+        if self.queue.is_async():
+            self.queue.enqueue_password(user, password)
+            res = None
+        else:
+            res = self.svnadmin.set_password(user, password)
+        self.log.info("AccountManagerToSVNReplication: user_password_changed: %s, %s" % (user, res or self._ok()))
         return res
 
     def user_deleted(self, user):
         """User deleted"""
-        res = self.svnadmin.delete_user(user)
-        self.log.info("AccountManagerToSVNReplication: user_deleted: %s, %s" % (user, res or 'OK'))
+        if self.queue.is_async():
+            self.queue.enqueue_delete(user)
+            res = None
+        else:
+            res = self.svnadmin.delete_user(user)
+        self.log.info("AccountManagerToSVNReplication: user_deleted: %s, %s" % (user, res or self._ok()))
         return res
 
     def user_password_reset(self, user, email, password):
@@ -44,3 +66,79 @@ class AccountManagerToSVNReplication(Component):
         """User verification requested"""
         pass
 
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('svnadmin sync-users', '[--dry-run]',
+               """Synchronize SVN password file with AccountManager
+
+               Adds, updates and deletes SVN users so that SVN password
+               file contains exactly the users and password hashes of
+               AccountManager password store. With --dry-run only
+               reports the changes.
+               """,
+               None, self._do_sync_users)
+
+    def _do_sync_users(self, *args):
+        dry_run = '--dry-run' in args
+        if not self.svnadmin.passwd_path:
+            raise AdminCommandError('SVN password file location is not set')
+        start = time.time()
+        source = self._get_account_hashes()
+        target = HtpasswdFile(self.svnadmin.passwd_path)
+        target.load()
+        target = target.entries
+
+        source_users = set(source)
+        target_users = set(target)
+        added = source_users - target_users
+        deleted = target_users - source_users
+        updated = set(u for u in source_users & target_users
+                      if source[u] != target[u])
+
+        errors = 0
+        if not dry_run and (added or updated or deleted):
+            if self.svnadmin.htpasswd_backend != 'builtin':
+                raise AdminCommandError('Synchronization requires builtin '
+                                        'htpasswd backend')
+            hashes = [(u, source[u]) for u in added | updated]
+            results = self.svnadmin.update_users(hashes=hashes,
+                                                 deleted=deleted)
+            for username, err in sorted(results.iteritems()):
+                if err:
+                    errors += 1
+                    printout('%s: %s' % (username, err))
+
+        printout('%s%d added, %d updated, %d deleted, %d unchanged, '
+                 '%d errors in %.2fs' %
+                 ('Dry run: ' if dry_run else '',
+                  len(added), len(updated), len(deleted),
+                  len(source_users) - len(added) - len(updated),
+                  errors, time.time() - start))
+
+    def _get_account_hashes(self):
+        '''Return dict of usernames (utf-8 encoded) and htpasswd
+        compatible hashes from AccountManager password store.'''
+        stores = AccountManager(self.env).password_store
+        if not isinstance(stores, (list, tuple)):
+            stores = [stores]
+        for store in stores:
+            if isinstance(store, HtPasswdStore):
+                passwd = HtpasswdFile(str(store.filename))
+                passwd.load()
+                return dict(passwd.entries)
+            if isinstance(store, SessionStore) and \
+                    isinstance(store.hash_method, HtPasswdHashMethod):
+                db = self.env.get_read_db()
+                cursor = db.cursor()
+                cursor.execute("SELECT sid, value FROM session_attribute "
+                               "WHERE authenticated=1 AND name='password'")
+                return dict((sid.encode('utf-8'), hash.encode('utf-8'))
+                            for sid, hash in cursor)
+        raise AdminCommandError('AccountManager password store does not '
+                                'provide htpasswd compatible hashes')
+
+    def _ok(self):
+        return 'queued' if self.queue.is_async() else 'OK'
+
+
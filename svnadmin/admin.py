@@ -1,27 +1,39 @@
 # SVNAdmin plugin
 
+import csv
+import json
 import os
 import os.path
 import subprocess
+import sys
+import time
 
 from genshi.builder import tag
 
-from trac.admin import IAdminPanelProvider
-from trac.config import ListOption, Option
+from trac.admin import AdminCommandError, IAdminCommandProvider, \
+                       IAdminPanelProvider
+from trac.config import IntOption, ListOption, Option
 from trac.core import *
-from trac.util import is_path_below
-from trac.util.text import exception_to_unicode
+from trac.util import as_bool, as_int, is_path_below
+from trac.util.presentation import Paginator
+from trac.util.datefmt import format_datetime
+from trac.util.text import exception_to_unicode, print_table, printout, \
+                           to_unicode
 from trac.util.translation import _, tag_
-from trac.web.chrome import ITemplateProvider, add_notice, add_warning, add_stylesheet
-from trac.web.href import Href
-from trac.versioncontrol import DbRepositoryProvider
+from trac.web.chrome import ITemplateProvider, add_link, add_notice, add_warning, add_stylesheet
 
 from svnadmin.api import SvnAdmin, SvnRepositoryProvider
+from svnadmin.authz import SvnAuthzManager
+from svnadmin.replication import SvnReplicationQueue
+from svnadmin.stats import SvnRepositoryStatistics
+from svnadmin.timing import BUCKETS, SvnOperationTimer
+from svnadmin.util import ConcurrentUpdateError, get_update_dirs
+from svnadmin.verification import SvnRepositoryVerifier
 
 class SvnAdminPanel(Component):
     """Component providing svnadmin management of repositories."""
     
-    implements(IAdminPanelProvider, ITemplateProvider)
+    implements(IAdminCommandProvider, IAdminPanelProvider, ITemplateProvider)
     
     allowed_repository_dir_prefixes = ListOption('versioncontrol',
         'allowed_repository_dir_prefixes', '',
@@ -34,14 +46,106 @@ class SvnAdminPanel(Component):
          'Default url prefix. If not empty, new repos will got url '
          '`Href(<prefix>)(<repos name>)`.')
 
+    repos_per_page = IntOption('svnadmin', 'repos_per_page', 100,
+         'Number of repositories shown per page.')
+    users_per_page = IntOption('svnadmin', 'users_per_page', 100,
+         'Number of SVN users shown per page.')
+
     def __init__(self):
         self.svnadmin = SvnAdmin(self.env)
 
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('svnadmin repository bulk-add', '<file> [project_id]',
+               """Create many SVN repositories at once
+
+               Repository names are read from CSV <file> (use - for
+               standard input), one `name[,project_id]` per line.
+               Repositories are created in parallel, registered in Trac
+               and the repository list is reloaded once.
+               """,
+               None, self._do_bulk_add)
+        yield ('svnadmin repository trash', '',
+               'List removed repositories which can be restored',
+               None, self._do_trash_list)
+        yield ('svnadmin repository restore', '<entry> [project_id]',
+               """Restore removed repository from trash
+
+               <entry> is a trash entry name as shown by
+               `svnadmin repository trash` command.
+               """,
+               None, self._do_restore)
+        yield ('svnadmin hooks sync', '[--dry-run]',
+               """Synchronize hooks of all repositories with hooks_path
+
+               Only hooks which differ from the source files are copied
+               (or linked). With --dry-run only reports the changes.
+               """,
+               None, self._do_hooks_sync)
+        yield ('svnadmin skeleton rebuild', '',
+               """Rebuild skeleton repository used to create new repositories
+
+               Also drops repositories pre-created from the old skeleton.
+               """,
+               None, self._do_skeleton_rebuild)
+
+    def _do_bulk_add(self, filename, project_id=0):
+        project_id = as_int(project_id, 0)
+        try:
+            if filename == '-':
+                lines = sys.stdin.readlines()
+            else:
+                fp = open(filename, 'rb')
+                try:
+                    lines = fp.readlines()
+                finally:
+                    fp.close()
+        except IOError, e:
+            raise AdminCommandError(exception_to_unicode(e))
+        repositories = self._parse_repository_list(lines, project_id)
+        svn_provider = self.env[SvnRepositoryProvider]
+        results = svn_provider.add_repositories(repositories,
+                                                self.repos_url_prefix)
+        for name, err in results.iteritems():
+            printout('%s: %s' % (name, err or 'OK'))
+        printout('%d of %d repositories created'
+                 % (len([e for e in results.itervalues() if not e]),
+                    len(results)))
+
+    def _do_trash_list(self):
+        svn_provider = self.env[SvnRepositoryProvider]
+        print_table([(entry, name, format_datetime(removed))
+                     for entry, name, removed in svn_provider.get_trash()],
+                    ['Entry', 'Repository', 'Removed'])
+
+    def _do_restore(self, entry, project_id=0):
+        svn_provider = self.env[SvnRepositoryProvider]
+        name = svn_provider.restore_repository(entry, as_int(project_id, 0))
+        printout('Repository %s has been restored' % name)
+
+    def _do_hooks_sync(self, *args):
+        dry_run = '--dry-run' in args
+        start = time.time()
+        changes, errors = self.env[SvnRepositoryProvider].sync_hooks(dry_run)
+        for name, changed in sorted(changes.iteritems()):
+            printout('%s: %s' % (name, ', '.join(changed)))
+        for name, err in sorted(errors.iteritems()):
+            printout('%s: %s' % (name, err))
+        printout('%s%d repositories changed, %d errors in %.2fs'
+                 % ('Dry run: ' if dry_run else '', len(changes), len(errors),
+                    time.time() - start))
+
+    def _do_skeleton_rebuild(self):
+        path = self.env[SvnRepositoryProvider].rebuild_skeleton()
+        printout('Skeleton repository %s has been rebuilt' % path)
+
     # IAdminPanelProvider methods
     def get_admin_panels(self, req):
         if 'VERSIONCONTROL_ADMIN' in req.perm:
             yield ('svnadmin', _("SVNAdmin"), 'config', _("Configuration"))
             yield ('svnadmin', _("SVNAdmin"), 'repositories', _("Repositories"))
+            yield ('svnadmin', _("SVNAdmin"), 'timing', _("Operation timing"))
         if 'TRAC_ADMIN' in req.perm:
             yield ('svnadmin', _("SVNAdmin"), 'authz_raw', _("Edit authz file"))
             yield ('svnadmin', _("SVNAdmin"), 'htpasswd', _("Add / remove SVN users"))
@@ -59,6 +163,8 @@ class SvnAdminPanel(Component):
         elif page == 'htpasswd':
             req.perm.require('TRAC_ADMIN')
             return self._do_htpasswd(req)
+        elif page == 'timing':
+            return self._do_timing(req, category, page)
         
     def _do_config(self, req, category, page):
         parentpath = self.config.get('svnadmin', 'parent_path')
@@ -76,8 +182,28 @@ class SvnAdminPanel(Component):
             self.config.set('svnadmin', 'svn_client_location', client)
             self.config.set('svnadmin', 'svnadmin_location', admin)
             self.config.set('svnadmin', 'hooks_path', hookspath)
-            self.config.save()
+            with SvnOperationTimer(self.env).timed('write config'):
+                self.config.save()
             add_notice(req, _('The settings have been saved.'))
+        elif req.method == 'POST' and req.args.get('sync_hooks'):
+            dry_run = as_bool(req.args.get('dry_run'))
+            start = time.time()
+            try:
+                changes, errors = \
+                    self.env[SvnRepositoryProvider].sync_hooks(dry_run)
+            except TracError, e:
+                add_warning(req, to_unicode(e))
+            else:
+                for name, changed in sorted(changes.iteritems()):
+                    add_notice(req, _('%(name)s: %(hooks)s', name=name,
+                                      hooks=', '.join(changed)))
+                for name, err in sorted(errors.iteritems()):
+                    add_warning(req, _('%(name)s: %(error)s', name=name,
+                                       error=err))
+                add_notice(req, _('%(dry_run)s%(num)d repositories changed '
+                                  'in %(time).2fs',
+                                  dry_run=dry_run and _('Dry run: ') or '',
+                                  num=len(changes), time=time.time() - start))
         
         data = {
             'parentpath': parentpath,
@@ -100,7 +226,6 @@ class SvnAdminPanel(Component):
         data = {}
         
         svn_provider = self.env[SvnRepositoryProvider]
-        db_provider = self.env[DbRepositoryProvider]
         
         if req.method == 'POST':
             # Add a repository
@@ -110,15 +235,14 @@ class SvnAdminPanel(Component):
                 if name is None or name == "" or not dir:
                     add_warning(req, _('Missing arguments to add a repository.'))
                 elif self._check_dir(req, dir):
-                    try:
-                        svn_provider.add_repository(name)
-                        db_provider.add_repository(name, 0, dir, 'svn')  # TODO: selectable project_id
-                        extra = {}
-                        if self.repos_url_prefix:
-                            href = Href(self.repos_url_prefix)
-                            extra['url'] = href(name)
-                        if extra:
-                            db_provider.modify_repository(name, extra)
+                    project_id = as_int(req.args.get('project_id'), 0)
+                    # created and registered like by bulk add, so that the
+                    # watcher doesn't register the repository first
+                    err = svn_provider.add_repositories(
+                            [(name, project_id)], self.repos_url_prefix)[name]
+                    if err:
+                        add_warning(req, err)
+                    else:
                         add_notice(req, _('The repository "%(name)s" has been '
                                           'added.', name=name))
                         resync = tag.tt('trac-admin $ENV repository resync '
@@ -135,28 +259,103 @@ class SvnAdminPanel(Component):
                                    cset_added=cset_added)
                         add_notice(req, msg)
                         req.redirect(req.href.admin(category, page))
-                    except TracError, why:
-                        add_warning(req, str(why))
             
+            # Add many repositories
+            elif svn_provider and req.args.get('bulk_add'):
+                project_id = as_int(req.args.get('project_id'), 0)
+                repositories = self._parse_repository_list(
+                        req.args.get('names', '').splitlines(), project_id)
+                repositories = [(name, pid) for name, pid in repositories
+                                if self._check_dir(req,
+                                        os.path.join(parentpath, name))]
+                if not repositories:
+                    add_warning(req, _('Missing arguments to add a repository.'))
+                else:
+                    results = svn_provider.add_repositories(
+                            repositories, self.repos_url_prefix)
+                    added = [name for name, err in results.iteritems()
+                             if not err]
+                    for name, err in results.iteritems():
+                        if err:
+                            add_warning(req, _('%(name)s: %(error)s',
+                                               name=name, error=err))
+                    if added:
+                        add_notice(req, _('%(num)d repositories have been '
+                                          'added: %(names)s', num=len(added),
+                                          names=', '.join(added)))
+                    if len(added) == len(results):
+                        req.redirect(req.href.admin(category, page))
+
             # Remove repositories
             elif svn_provider and req.args.get('remove'):
                 sel = req.args.getlist('sel')
                 if sel:
-                    for name in sel:
-                        svn_provider.remove_repository(name)
-                        db_provider.remove_repository(name)
-                    add_notice(req, _('The selected repositories have '
-                                      'been removed.'))
-                    req.redirect(req.href.admin(category, page))
-                add_warning(req, _('No repositories were selected.'))
-
-        # Find repositories that are editable
-        repos = {}
-        if svn_provider is not None:
-            repos = svn_provider.get_repositories()
+                    results = svn_provider.remove_repositories(sel)
+                    errors = [err for err in results.itervalues() if err]
+                    for err in errors:
+                        add_warning(req, err)
+                    if not errors:
+                        add_notice(req, _('The selected repositories have '
+                                          'been removed.'))
+                        req.redirect(req.href.admin(category, page))
+                else:
+                    add_warning(req, _('No repositories were selected.'))
+
+        # Find repositories that are editable, details are retrieved
+        # only for the shown page
+        filter = req.args.get('q', '').strip()
+        project_id = as_int(req.args.get('project'), None)
+        sort = req.args.get('sort')
+        if sort not in ('size', 'revisions', 'last_commit', 'growth'):
+            sort = 'name'
+        desc = as_bool(req.args.get('desc'))
+        pagenum = max(1, as_int(req.args.get('page'), 1))
+        max_per_page = self.repos_per_page
+        offset = (pagenum - 1) * max_per_page
+        statistics = self.env[SvnRepositoryStatistics]
+        stats = statistics.get_stats() if statistics else {}
+        if svn_provider is None:
+            names, num_repos = [], 0
+        elif sort == 'name':
+            names, num_repos = svn_provider.find_repositories(
+                    filter, desc, offset, max_per_page, project_id)
+        else:
+            # sort by stored statistics, repositories without them last
+            names, num_repos = svn_provider.find_repositories(
+                    filter, project_id=project_id)
+            def sort_key(name):
+                value = stats.get(name, {}).get(sort)
+                return (value is None) != desc, value
+            names = sorted(names, key=sort_key,
+                           reverse=desc)[offset:offset + max_per_page]
+        repos = [(name, svn_provider.get_repository_info(name))
+                 for name in names]
+        def href(**kwargs):
+            args = {'q': filter or None, 'project': project_id,
+                    'desc': desc and '1' or None,
+                    'sort': sort != 'name' and sort or None}
+            args.update(kwargs)
+            return req.href.admin(category, page, **args)
+        paginator = self._prepare_paginator(req, repos, num_repos, pagenum,
+                                            max_per_page, href)
+        verifier = self.env[SvnRepositoryVerifier]
+        verification = verifier.get_status() if verifier else {}
         
         # Prepare common rendering data
-        data.update({'repositories': repos})
+        data.update({
+            'repositories': paginator,
+            'paginator': paginator,
+            'q': filter,
+            'project': project_id,
+            'sort': sort,
+            'desc': desc,
+            'sort_href': lambda col: href(sort=col != 'name' and col or None,
+                                          desc=(col == sort and not desc)
+                                               and '1' or None,
+                                          page=None),
+            'verification': verification,
+            'stats': stats,
+        })
         
         add_stylesheet(req, 'svnadmin/css/svnadmin.css')
         return 'repositories.html', data
@@ -168,6 +367,15 @@ class SvnAdminPanel(Component):
         # test if authz file exists and is writable
         if not os.access(authz_file,os.W_OK|os.R_OK):
             raise TracError("Can't access authz file %s" % authz_file)
+        # the file is replaced by rename and locked by `.lock` file next
+        # to it, both need a writable directory
+        for dir in get_update_dirs(authz_file):
+            if not os.access(dir, os.W_OK | os.X_OK):
+                raise TracError("Can't write to directory of authz file %s"
+                                % dir)
+
+        manager = self.env[SvnAuthzManager]
+        conflict = None
 
         # evaluate forms
         if req.method == 'POST':
@@ -176,39 +384,49 @@ class SvnAdminPanel(Component):
             # encode to utf-8
             current = current.encode('utf-8')
 
-            # parse and validate authz file with a config parser
-            from ConfigParser import ConfigParser
-            from StringIO import StringIO
-            cp = ConfigParser()
+            # validate and write to disk unless the file has been changed
+            # since the form was loaded
             try:
-                cp.readfp(StringIO(current))
-            except Exception, e:
-                raise TracError("Invalid Syntax: %s" % exception_to_unicode(e))
-
-            # write to disk
-            try:
-                fp = open(authz_file, 'wb')
-                current = fp.write(current)
-                fp.close()
-            except Exception, e:
-                raise TracError("Can't write authz file: %s" % exception_to_unicode(e))
-
-            add_notice(req, _('Your changes have been saved.'))
-            req.redirect(req.panel_href())
+                manager.save_text(current, req.args.get('version') or None)
+            except ConcurrentUpdateError:
+                add_warning(req, _('The authz file has been changed by '
+                                   'someone else since you started editing. '
+                                   'Review its current contents below and '
+                                   'apply your changes again.'))
+                conflict = current
+            else:
+                add_notice(req, _('Your changes have been saved.'))
+                req.redirect(req.panel_href())
 
         # read current authz file
         current = ""
+        version = None
         try:
-            fp = open(authz_file,'r')
-            current = fp.read()
-            fp.close()
-        except Exception, e:
-            add_warning(req, 'Error occurred while reading authz file: %s' % exception_to_unicode(e))
+            current, version = manager.get_text()
+        except TracError, e:
+            add_warning(req, 'Error occurred while reading authz file: %s' % to_unicode(e))
 
-        return 'svnauthz_raw.html', {'auth_data':current}
+        data = {'auth_data': to_unicode(current), 'version': version}
+        if conflict is not None:
+            data['auth_data'] = to_unicode(conflict)
+            data['current_data'] = to_unicode(current)
+        return 'svnauthz_raw.html', data
 
     def _do_htpasswd(self, req):
-        if req.method == 'POST':
+        if req.method == 'POST' and req.args.has_key('remove_selected'):
+            sel = req.args.getlist('sel')
+            if not sel:
+                add_warning(req, _('No users were selected.'))
+            else:
+                results = self.svnadmin.update_users(deleted=sel)
+                errors = [err for err in results.itervalues() if err]
+                for err in set(errors):
+                    add_warning(req, err)
+                if not errors:
+                    add_notice(req, _('The selected users have been '
+                                      'removed.'))
+                    req.redirect(req.panel_href())
+        elif req.method == 'POST':
             username = req.args.get('username')
             if not username:
                 err = 'Username can not be empty'
@@ -229,12 +447,90 @@ class SvnAdminPanel(Component):
             else:
                 add_warning(req, err)
 
+        # List users
+        prefix = req.args.get('q', '').strip()
+        desc = as_bool(req.args.get('desc'))
+        page = max(1, as_int(req.args.get('page'), 1))
+        max_per_page = self.users_per_page
+        users, num_users = self.svnadmin.find_users(prefix, desc,
+                                                    (page - 1) * max_per_page,
+                                                    max_per_page)
+        def href(**kwargs):
+            args = {'q': prefix or None, 'desc': desc and '1' or None}
+            args.update(kwargs)
+            return req.href.admin('svnadmin', 'htpasswd', **args)
+        paginator = self._prepare_paginator(req, users, num_users, page,
+                                            max_per_page, href)
+
         data = {
             'username': req.args.get('username'),
             'password': req.args.get('password'),
+            'q': prefix,
+            'desc': desc,
+            'sort_href': href(desc=not desc and '1' or None),
+            'paginator': paginator,
         }
+        queue = SvnReplicationQueue(self.env)
+        if queue.is_async():
+            data['queue_depth'], data['queue_lag'] = queue.get_status()
         return 'svn_htpasswd.html', data
 
+    def _do_timing(self, req, category, page):
+        timer = SvnOperationTimer(self.env)
+        if req.method == 'POST' and req.args.get('reset'):
+            timer.reset()
+            add_notice(req, _('Timing statistics have been reset.'))
+            req.redirect(req.href.admin(category, page))
+        stats = timer.get_stats()
+        if req.args.get('format') == 'json':
+            req.send(json.dumps({'buckets': BUCKETS,
+                                 'threshold': timer.slow_operation_threshold,
+                                 'operations': stats}),
+                     'application/json')
+        add_link(req, 'alternate', req.href.admin(category, page,
+                                                  format='json'),
+                 _('JSON'), 'application/json', 'json')
+        data = {
+            'operations': sorted(stats.iteritems()),
+            'buckets': BUCKETS,
+            'threshold': timer.slow_operation_threshold,
+            'json_href': req.href.admin(category, page, format='json'),
+        }
+        add_stylesheet(req, 'svnadmin/css/svnadmin.css')
+        return 'svn_timing.html', data
+
+    def _prepare_paginator(self, req, items, num_items, page, max_per_page,
+                           href):
+        """Return `Paginator` over already sliced `items` with page links
+        built by `href(page=...)`."""
+        paginator = Paginator(items, page - 1, max_per_page, num_items)
+        if paginator.has_next_page:
+            add_link(req, 'next', href(page=page + 1), _('Next Page'))
+        if paginator.has_previous_page:
+            add_link(req, 'prev', href(page=page - 1), _('Previous Page'))
+        paginator.shown_pages = [{'href': href(page=p), 'class': None,
+                                  'string': str(p),
+                                  'title': _('Page %(num)d', num=p)}
+                                 for p in paginator.get_shown_pages(21)]
+        paginator.current_page = {'href': None, 'class': 'current',
+                                  'string': str(paginator.page + 1),
+                                  'title': None}
+        return paginator
+
+    def _parse_repository_list(self, lines, project_id=0):
+        """Parse CSV lines `name[,project_id]` into list of
+        (name, project_id) pairs."""
+        repositories = []
+        for row in csv.reader(line.encode('utf-8')
+                              if isinstance(line, unicode) else line
+                              for line in lines):
+            row = [to_unicode(col).strip() for col in row]
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            pid = as_int(row[1], project_id) if len(row) > 1 else project_id
+            repositories.append((row[0], pid))
+        return repositories
+
     def _check_dir(self, req, dir):
         """Check that a repository directory is valid, and add a warning
         message if not.
@@ -1,16 +1,59 @@
 # SVNAdmin plugin
 
+import errno
 import os
 import os.path
+import shlex
 import subprocess
 import shutil
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from hashlib import md5
+from multiprocessing.pool import ThreadPool
 
-from trac.config import Option, BoolOption
+from trac.config import BoolOption, ChoiceOption, IntOption, Option
 from trac.core import *
-from trac.util.text import exception_to_unicode
+from trac.util.datefmt import utc
+from trac.util.text import exception_to_unicode, to_unicode
 from trac.util.translation import _
 from trac.versioncontrol import IRepositoryProvider, RepositoryManager
+from trac.web.api import IRequestFilter
+from trac.web.href import Href
 
+from svnadmin.backend import BindingsBackend, SubprocessBackend, \
+                             SvnBackendError, has_bindings
+from svnadmin.htpasswd import HASH_METHODS, HtpasswdFile
+from svnadmin.timing import SvnOperationTimer
+from svnadmin.util import BackgroundThread, FileLock, atomic_write, \
+                          get_update_dirs
+
+
+# service directory inside parent path
+WORK_DIR = '.svnadmin'
+
+# maximum delay in seconds between retries of trash entries which can't
+# be purged
+MAX_PURGE_BACKOFF = 3600
+
+# reservations of repository names being provisioned older than this
+# number of seconds are ignored (e.g. left behind by a killed process)
+RESERVATION_TIMEOUT = 3600
+
+
+
+def _file_checksum(path):
+    fp = open(path, 'rb')
+    try:
+        digest = md5()
+        for chunk in iter(lambda: fp.read(65536), ''):
+            digest.update(chunk)
+        return digest.hexdigest()
+    finally:
+        fp.close()
 
 
 class SvnAdmin(Component):
@@ -19,6 +62,21 @@ class SvnAdmin(Component):
          'Htpasswd executable location')
     passwd_path = Option('svnadmin', 'passwd_path', '',
          'Path to file with SWV users (AuthUserFile)')
+    htpasswd_backend = ChoiceOption('svnadmin', 'htpasswd_backend',
+         ['builtin', 'subprocess'],
+         'How to update SVN password file: `builtin` updates it in-process, '
+         '`subprocess` calls htpasswd executable.')
+    hash_method = ChoiceOption('svnadmin', 'hash_method', HASH_METHODS,
+         'Password hash method used by builtin htpasswd backend: '
+         '`md5` (APR1-MD5), `sha1` or `bcrypt` (requires bcrypt module).')
+
+    def __init__(self):
+        self._passwd_file = None
+        self._passwd_lock = threading.Lock()
+        self._user_index = (None, [])  # (file stamp, sorted usernames)
+        # set by `SvnAdminWatcher`, the password file is then read again
+        # only after `invalidate_cache()`
+        self.watched = False
 
     # Public API
 
@@ -27,31 +85,194 @@ class SvnAdmin(Component):
         Return None on success or error string on fail.
         Raise exception when configuration options are empty.'''
 
-        try:
-            args = (self.htpasswd, '-b', self.passwd_path, username, password)
-            ret = subprocess.call(args)
-        except Exception, e:
-            return ('Error occurred while calling htpasswd: %s' % exception_to_unicode(e))
-
-        if ret == 0:
-            return  # success
-
-        err = self._return_code_msg(ret)
-        if err:
-            return err
+        if self.htpasswd_backend == 'subprocess':
+            return self._htpasswd_call(('-b', username, password),
+                                      'setting SVN password')
 
-        return 'Error occurred while setting SVN password. Htpasswd returned %s.' % ret
+        def do_set(passwd):
+            passwd.set_password(username, password, self.hash_method)
+        return self._update_passwd_file(do_set)
 
     def delete_user(self, username):
         '''Delete SVN user.
         Return None on success or error string on fail.
         Do nothing (as success) if user doesn't exist.'''
 
+        if self.htpasswd_backend == 'subprocess':
+            return self._htpasswd_call(('-D', username),
+                                      'deleting SVN user')
+
+        def do_delete(passwd):
+            return passwd.delete(username)
+        return self._update_passwd_file(do_delete)
+
+    def update_users(self, passwords=None, deleted=None, hashes=None):
+        '''Add / change / delete many SVN users at once.
+        `passwords` is a dict (or list of pairs) of usernames and new
+        passwords, `deleted` is a list of usernames to delete.
+        `hashes` is like `passwords` but with already hashed passwords
+        (see `hash_password`), it is supported by builtin backend only.
+        Password file is rewritten only once.
+        Return dict with None on success or error string on fail
+        for each username.'''
+
+        return self._update_users(passwords, deleted, hashes)[0]
+
+    def _update_users(self, passwords=None, deleted=None, hashes=None):
+        '''Like `update_users` but return tuple (dict of results, error
+        string if password file could not be accessed or None).'''
+        if isinstance(passwords, dict):
+            passwords = passwords.iteritems()
+        if isinstance(hashes, dict):
+            hashes = hashes.iteritems()
+        passwords = list(passwords or ())
+        hashes = list(hashes or ())
+        deleted = list(deleted or ())
+        results = {}
+
+        if self.htpasswd_backend == 'subprocess':
+            for username, password in passwords:
+                results[username] = self.set_password(username, password)
+            for username in deleted:
+                results[username] = self.delete_user(username)
+            for username, hash in hashes:
+                results[username] = 'Hashed passwords are not supported ' \
+                                    'by subprocess htpasswd backend'
+            return results, None
+
+        def do_update(passwd):
+            changed = False
+            for username, password in passwords:
+                try:
+                    passwd.set_password(username, password, self.hash_method)
+                    results[username] = None
+                    changed = True
+                except ValueError, e:
+                    results[username] = to_unicode(e)
+            for username, hash in hashes:
+                try:
+                    passwd.set_hash(username, hash)
+                    results[username] = None
+                    changed = True
+                except ValueError, e:
+                    results[username] = to_unicode(e)
+            for username in deleted:
+                changed = passwd.delete(username) or changed
+                results[username] = None
+            return changed
+        err = self._update_passwd_file(do_update)
+        if err:
+            for username, value in passwords + hashes:
+                results[username] = err
+            for username in deleted:
+                results[username] = err
+        return results, err
+
+    def find_users(self, prefix='', desc=False, offset=0, limit=None):
+        '''Return tuple (list of usernames, number of found users) of SVN
+        users whose names start with `prefix`, sorted by name.
+        Only the `offset`..`offset + limit` slice of the result is
+        returned.'''
+        names = self._get_user_index()
+        prefix = prefix.encode('utf-8') if isinstance(prefix, unicode) \
+                 else prefix
+        lo = bisect_left(names, prefix)
+        hi = bisect_left(names, prefix + '\xff') if prefix else len(names)
+        total = hi - lo
+        if limit is None:
+            limit = total
+        if desc:
+            start, stop = max(lo, hi - offset - limit), max(lo, hi - offset)
+            found = names[start:stop][::-1]
+        else:
+            found = names[min(hi, lo + offset):min(hi, lo + offset + limit)]
+        return [to_unicode(name) for name in found], total
+
+    def invalidate_cache(self):
+        '''Read the password file again on the next access.'''
+        with self._passwd_lock:
+            self._passwd_file = None
+
+    def check_passwd_file(self):
+        '''Check that SVN password file can be updated.
+        Return None on success or error string on fail.'''
+        path = self.passwd_path
+        if not path:
+            return 'SVN password file location is not set'
+        if os.path.exists(path) and not os.access(path, os.R_OK | os.W_OK):
+            return "Can't access SVN password file: %s" % path
+        # the file is replaced by rename and locked by `.lock` file next
+        # to it, both need a writable directory
+        for dir in get_update_dirs(path):
+            if not os.access(dir, os.W_OK | os.X_OK):
+                return "Can't write to directory of SVN password file: %s" \
+                       % dir
+
+    # Internal methods
+
+    def _get_passwd_file(self):
+        if self._passwd_file is None or \
+                self._passwd_file.path != self.passwd_path:
+            self._passwd_file = HtpasswdFile(self.passwd_path)
+        return self._passwd_file
+
+    def _get_user_index(self):
+        '''Return sorted list of usernames (utf-8 encoded), rebuilt only
+        when the password file has been changed.'''
+        if not self.passwd_path:
+            return []
+        with self._passwd_lock:
+            passwd = self._get_passwd_file()
+            try:
+                if not self.watched or passwd._stamp is None:
+                    passwd.load()
+            except IOError, e:
+                self.log.warning("Can't read SVN password file: %s",
+                                 exception_to_unicode(e))
+                return []
+            stamp, names = self._user_index
+            if stamp != (passwd.path, passwd._stamp):
+                names = sorted(passwd.entries)
+                self._user_index = ((passwd.path, passwd._stamp), names)
+            return names
+
+    def _update_passwd_file(self, fn):
+        '''Call `fn(passwd)` with loaded `HtpasswdFile` and save it
+        unless `fn` returns False.
+        Return None on success or error string on fail.'''
+        if not self.passwd_path:
+            raise TracError(_('SVN password file location is not set'))
+        with self._passwd_lock:
+            passwd = self._get_passwd_file()
+            try:
+                with FileLock(self.passwd_path):
+                    passwd.load()
+                    try:
+                        changed = fn(passwd)
+                    except ValueError, e:
+                        passwd.load(force=True)
+                        return to_unicode(e)
+                    if changed is not False:
+                        timer = SvnOperationTimer(self.env)
+                        with timer.timed('write passwd') as t:
+                            t.size = passwd.save()
+            except (IOError, OSError), e:
+                self._passwd_file = None
+                return "Can't access SVN password file: %s (%s)" % \
+                       (self.passwd_path, exception_to_unicode(e))
+
+    def _htpasswd_call(self, args, action):
+        '''Call htpasswd executable with password file path and `args`.
+        Return None on success or error string on fail.'''
         try:
-            args = (self.htpasswd, '-D', self.passwd_path, username)
-            ret = subprocess.call(args)
+            args = (self.htpasswd, args[0], self.passwd_path) + args[1:]
+            # serialize with other writers of the password file
+            with FileLock(self.passwd_path):
+                with SvnOperationTimer(self.env).timed('htpasswd') as t:
+                    ret = t.exit_code = subprocess.call(args)
         except Exception, e:
             return ('Error occurred while calling htpasswd: %s' % exception_to_unicode(e))
+        self.invalidate_cache()
 
         if ret == 0:
             return  # success
@@ -60,8 +281,7 @@ class SvnAdmin(Component):
         if err:
             return err
 
-        # TODO: special cases for all return codes (see htpasswd(1) man)
-        return 'Error occurred while deleting SVN user. Htpasswd returned %s.' % ret
+        return 'Error occurred while %s. Htpasswd returned %s.' % (action, ret)
 
     def _return_code_msg(self, ret):
         '''Return error string for known error codes
@@ -74,7 +294,7 @@ class SvnAdmin(Component):
 class SvnRepositoryProvider(Component):
     """Component providing repositories registered in the SVN parent directory."""
 
-    implements(IRepositoryProvider)
+    implements(IRepositoryProvider, IRequestFilter)
     
     svnadmin = Option('svnadmin', 'svnadmin_location', 'svnadmin',
          'Subversion admin executable location')
@@ -92,79 +312,832 @@ class SvnRepositoryProvider(Component):
          '`chmod` command arguments to perform on new repos. '
          'Leave empty to do nothing.')
 
+    svnlook = Option('svnadmin', 'svnlook_location', 'svnlook',
+         'Subversion svnlook executable location. Used to get youngest '
+         'revision of non-FSFS repositories.')
+    backend = ChoiceOption('svnadmin', 'backend',
+         ['auto', 'bindings', 'subprocess'],
+         'How to create, commit to and verify repositories: `bindings` '
+         'uses Subversion Python bindings in-process, `subprocess` calls '
+         'Subversion executables, `auto` uses bindings when available.')
+    use_skeleton = BoolOption('svnadmin', 'use_skeleton', 'false',
+         'Create new repositories by copying a skeleton repository, which '
+         'is built once with base structure, hooks and permissions.')
+    skeleton_pool_size = IntOption('svnadmin', 'skeleton_pool_size', 0,
+         'Number of repositories pre-created from the skeleton, so that '
+         'creating a repository is just a rename. Requires `use_skeleton`.')
+    trash_retention = IntOption('svnadmin', 'trash_retention', 0,
+         'Number of hours removed repositories are kept in trash and can '
+         'be restored. With 0 they are deleted immediately in the '
+         'background.')
+    hooks_link = BoolOption('svnadmin', 'hooks_link', 'false',
+         'Install hooks into repositories as symbolic links to files in '
+         '`hooks_path` instead of copies.')
+    create_workers = IntOption('svnadmin', 'create_workers', 4,
+         'Maximum number of repositories processed simultaneously by bulk '
+         'provisioning and hooks synchronization.')
+
+    def __init__(self):
+        # repos dir -> (mtime, size, youngest revision)
+        self._youngest_cache = {}
+        self._youngest_lock = threading.Lock()
+        self._names_cache = (None, None, [])  # (path, mtime, sorted names)
+        self._info_cache = {}  # repos dir -> (key, info)
+        # set by `SvnAdminWatcher`, cached data are then used without
+        # checking the file system until `invalidate_cache()` is called
+        self.watched = False
+        self._pool_thread = BackgroundThread('svnadmin-pool',
+                                             self._refill_pool, self.log)
+        self._purge_thread = BackgroundThread('svnadmin-trash',
+                                              self._purge_trash, self.log)
+        self._purge_checked = False
+
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        # purge trash left by a previous run of the process
+        if not self._purge_checked:
+            self._purge_checked = True
+            if self.get_trash():
+                self._purge_thread.start()
+        return handler
+
+    def post_process_request(self, req, template, data, content_type):
+        return template, data, content_type
+
+    # IRepositoryProvider methods
+
     def get_repositories(self, project_id=None, syllabus_id=None):
-        """Retrieve repositories in the SVN parent directory."""
+        """Retrieve repositories in the SVN parent directory.
+
+        With `project_id` or `syllabus_id` only repositories registered
+        for the project (or projects of the syllabus) are returned; they
+        are looked up in the database and only their directories are
+        accessed.
+        """
         if not self.parentpath or not os.path.exists(self.parentpath):
             return []
-        repos = os.listdir(self.parentpath)
+        scoped = project_id is not None or syllabus_id is not None
+        if scoped:
+            names = self.get_project_repository_names(project_id,
+                                                      syllabus_id)
+        else:
+            names = self.get_repository_names()
         reponames = {}
-        for name in repos:
+        for name in names:
             dir = os.path.join(self.parentpath, name)
-            
-            command = self.svnadmin + ' verify "%s"' % dir
-            process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            (result, error) = process.communicate()
-            
-            rev = result[result.rfind('revision') + 9:len(result) - 2]
-            displayrev = rev
-            if rev == '0':
-                rev = ''
-                displayrev = ''
+            if scoped and not os.path.isdir(dir):
+                continue
+            rev = self.get_youngest_rev(dir)
+            rev = str(rev) if rev else ''
             reponames[name] = {
                 'dir': dir,
                 'rev': rev,
-                'display_rev': displayrev
+                'display_rev': rev
             }
         return reponames.iteritems()
-    
+
+    def get_project_repository_names(self, project_id=None,
+                                     syllabus_id=None):
+        """Return sorted list of names of repositories registered for
+        project `project_id` and/or projects of syllabus `syllabus_id`."""
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        query = ("SELECT n.value FROM repository n "
+                 "INNER JOIN repository p ON (p.id=n.id "
+                 "AND p.name='project_id') WHERE n.name='name'")
+        args = []
+        if project_id is not None:
+            query += " AND p.value=%s"
+            args.append(str(project_id))
+        if syllabus_id is not None:
+            query += (" AND p.value IN (SELECT %s FROM projects "
+                      "WHERE syllabus_id=%%s)" % db.cast('id', 'text'))
+            args.append(syllabus_id)
+        cursor.execute(query + " ORDER BY n.value", args)
+        return [name for name, in cursor if name]
+
+    def invalidate_cache(self, name=None):
+        """Drop cached details of repository `name`, or the cached list
+        of repository names if `name` is None."""
+        if name is None:
+            self._names_cache = (None, None, [])
+            return
+        dir = os.path.join(self.parentpath, name)
+        with self._youngest_lock:
+            self._youngest_cache.pop(dir, None)
+        self._info_cache.pop(dir, None)
+
+    def get_backend(self):
+        """Return backend performing Subversion operations according to
+        the `backend` option."""
+        timer = SvnOperationTimer(self.env)
+        if self.backend != 'subprocess':
+            if has_bindings:
+                return BindingsBackend(timer)
+            if self.backend == 'bindings':
+                self.log.warning('Subversion Python bindings are not '
+                                 'available, using subprocess backend')
+        return SubprocessBackend(self.svnadmin, self.svnclient, self.svnlook,
+                                 timer)
+
+    def get_work_dir(self):
+        """Return path of the service directory inside the parent path,
+        create it if needed."""
+        workdir = os.path.join(self.parentpath, WORK_DIR)
+        if not os.path.isdir(workdir):
+            try:
+                os.mkdir(workdir)
+            except OSError, e:
+                if not os.path.isdir(workdir):
+                    raise TracError(exception_to_unicode(e))
+        return workdir
+
+    def get_reserved_names(self):
+        """Return set of names of repositories which are being
+        created, restored or registered by Trac."""
+        reserved = os.path.join(self.parentpath, WORK_DIR, 'reserved')
+        try:
+            markers = os.listdir(reserved)
+        except OSError:
+            return set()
+        names = set()
+        now = time.time()
+        for marker in markers:
+            try:
+                mtime = os.stat(os.path.join(reserved, marker)).st_mtime
+            except OSError:
+                continue
+            if now - mtime < RESERVATION_TIMEOUT:
+                names.add(marker.rpartition('@')[0])
+        return names
+
+    def get_repository_names(self):
+        """Return sorted list of repository names in the SVN parent
+        directory. The directory is listed again only when it has been
+        modified."""
+        path = self.parentpath
+        cached_path, cached_mtime, names = self._names_cache
+        if self.watched and cached_path == path:
+            return names
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return []
+        if cached_path == path and cached_mtime == mtime:
+            return names
+        names = sorted(name for name in os.listdir(path)
+                       if not name.startswith('.') and
+                          os.path.isdir(os.path.join(path, name)))
+        self._names_cache = (path, mtime, names)
+        return names
+
+    def find_repositories(self, filter='', desc=False, offset=0, limit=None,
+                          project_id=None):
+        """Return tuple (list of names, number of found repositories) of
+        repositories containing `filter` in name (case insensitive),
+        sorted by name. With `project_id` only repositories of the project
+        are searched. Only the `offset`..`offset + limit` slice of the
+        result is returned."""
+        if project_id is not None:
+            names = [name for name
+                     in self.get_project_repository_names(project_id)
+                     if os.path.isdir(os.path.join(self.parentpath, name))]
+        else:
+            names = self.get_repository_names()
+        if filter:
+            filter = filter.lower()
+            names = [name for name in names if filter in name.lower()]
+        if desc:
+            names = names[::-1]
+        if limit is None:
+            limit = len(names)
+        return names[offset:offset + limit], len(names)
+
+    def get_repository_info(self, name):
+        """Return dict with details of repository: `dir`, `rev`,
+        `display_rev`, `size` (in bytes) and `last_commit` (datetime).
+
+        Size is taken from the last scan of `SvnRepositoryStatistics`;
+        the repository directory is walked only if it hasn't been
+        scanned yet. Details are cached until a new revision is
+        committed.
+        """
+        dir = os.path.join(self.parentpath, name)
+        cached = self._info_cache.get(dir)
+        if self.watched and cached:
+            return cached[1]
+        rev = self.get_youngest_rev(dir)
+        try:
+            mtime = os.stat(os.path.join(dir, 'db', 'current')).st_mtime
+        except OSError:
+            mtime = None
+        key = (rev, mtime)
+        cached = self._info_cache.get(dir)
+        if cached and cached[0] == key:
+            return cached[1]
+        size = self._get_stored_size(name)
+        if size is None:
+            size = 0
+            for root, dirs, files in os.walk(dir):
+                for filename in files:
+                    try:
+                        size += os.lstat(os.path.join(root, filename)).st_size
+                    except OSError:
+                        pass
+        info = {
+            'dir': dir,
+            'rev': str(rev) if rev else '',
+            'display_rev': str(rev) if rev else '',
+            'size': size,
+            'last_commit': mtime and datetime.fromtimestamp(mtime, utc),
+        }
+        self._info_cache[dir] = (key, info)
+        return info
+
+    def _get_stored_size(self, name):
+        """Return repository size stored by the last statistics scan or
+        None."""
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT size FROM svnadmin_repository_stats "
+                       "WHERE repos=%s", (name,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get_youngest_rev(self, dir):
+        """Return youngest revision number of the repository located
+        in `dir` or None if it can't be determined.
+
+        For FSFS repositories revision is read from `db/current` and
+        cached until the file is modified. Other repositories are
+        queried with `svnlook youngest`.
+        """
+        if self.watched:
+            with self._youngest_lock:
+                cached = self._youngest_cache.get(dir)
+            if cached:
+                return cached[1]
+        current = os.path.join(dir, 'db', 'current')
+        try:
+            st = os.stat(current)
+        except OSError:
+            return self._query_youngest(dir)
+        key = (st.st_mtime, st.st_size)
+        with self._youngest_lock:
+            cached = self._youngest_cache.get(dir)
+        if cached and cached[0] == key:
+            return cached[1]
+        try:
+            fp = open(current, 'r')
+            try:
+                # first token: "<rev>" (format 3+) or "<rev> <node-id> <copy-id>"
+                rev = int(fp.readline().split()[0])
+            finally:
+                fp.close()
+        except (IOError, ValueError, IndexError), e:
+            self.log.warning("Can't read youngest revision from %s: %s",
+                             current, exception_to_unicode(e))
+            return None
+        with self._youngest_lock:
+            self._youngest_cache[dir] = (key, rev)
+        return rev
+
+    def _query_youngest(self, dir):
+        if not os.path.isdir(os.path.join(dir, 'db')):
+            return None  # not a repository
+        try:
+            return self.get_backend().youngest(dir)
+        except SvnBackendError, e:
+            self.log.warning("Can't get youngest revision of %s: %s",
+                             dir, e.message)
+            return None
+
     def add_repository(self, name):
         """Add a repository."""
+        markers = self._reserve([name])
+        try:
+            self._create_repository(name)
+        finally:
+            self._release(markers)
+        rm = RepositoryManager(self.env)
+        rm.reload_repositories()
+
+    def add_repositories(self, repositories, url_prefix=''):
+        """Create many repositories at once and register them in
+        `DbRepositoryProvider`.
+
+        `repositories` is a list of (name, project_id) pairs. Repositories
+        are created concurrently by up to `create_workers` workers,
+        registered in a single transaction and repository manager is
+        reloaded once (see `register_repositories`). If `url_prefix` is
+        given, repository url is set to `Href(url_prefix)(name)`. Names
+        listed more than once are rejected and not created.
+        Return dict with None on success or error string on fail
+        for each repository name.
+        """
+        repositories = list(repositories)
+        counts = {}
+        for name, pid in repositories:
+            counts[name] = counts.get(name, 0) + 1
+        results = OrderedDict()
+        unique = []
+        for name, pid in repositories:
+            if counts[name] > 1:
+                results[name] = _('The repository "%(name)s" is listed '
+                                  'more than once.', name=name)
+            else:
+                results[name] = None
+                unique.append((name, pid))
+        def create(name):
+            try:
+                self._create_repository(name)
+            except TracError, e:
+                return to_unicode(e)
+        # the watcher must not register the repositories before we do
+        markers = self._reserve([name for name, pid in unique])
+        try:
+            pool = ThreadPool(max(1, self.create_workers))
+            try:
+                errors = pool.map(create, [name for name, pid in unique])
+            finally:
+                pool.close()
+                pool.join()
+            for (name, pid), err in zip(unique, errors):
+                results[name] = err
+
+            created = [(name, pid) for name, pid in unique
+                       if not results[name]]
+            if created:
+                self.register_repositories(created, url_prefix)
+        finally:
+            self._release(markers)
+        return results
+
+    def register_repositories(self, repositories, url_prefix=''):
+        """Register repositories in `DbRepositoryProvider`.
+
+        `repositories` is a list of (name, project_id) pairs. The rows
+        of the `repository` table are written in a single transaction
+        and repository manager is reloaded once, whereas
+        `DbRepositoryProvider` reloads it on every change. Attributes
+        of already registered repositories are updated.
+        """
+        rm = RepositoryManager(self.env)
+        href = url_prefix and Href(url_prefix)
+        @self.env.with_transaction()
+        def do_register(db):
+            cursor = db.cursor()
+            for name, pid in repositories:
+                attrs = {'dir': os.path.join(self.parentpath, name),
+                         'type': 'svn', 'project_id': str(pid)}
+                if href:
+                    attrs['url'] = href(name)
+                id = rm.get_repository_id(name)
+                for key, value in sorted(attrs.iteritems()):
+                    cursor.execute("UPDATE repository SET value=%s "
+                                   "WHERE id=%s AND name=%s",
+                                   (value, id, key))
+                    cursor.execute("SELECT value FROM repository "
+                                   "WHERE id=%s AND name=%s", (id, key))
+                    if not cursor.fetchone():
+                        cursor.execute("INSERT INTO repository "
+                                       "(id, name, value) "
+                                       "VALUES (%s, %s, %s)",
+                                       (id, key, value))
+        rm.reload_repositories()
+
+    def _reserve(self, names):
+        """Mark repositories `names` as being provisioned (see
+        `get_reserved_names`). Return list of marker files to be passed
+        to `_release`."""
+        markers = []
+        try:
+            reserved = os.path.join(self.get_work_dir(), 'reserved')
+            if not os.path.isdir(reserved):
+                try:
+                    os.mkdir(reserved)
+                except OSError:
+                    if not os.path.isdir(reserved):
+                        raise
+            for name in names:
+                if not name or '/' in name or os.sep in name:
+                    continue
+                fd, marker = tempfile.mkstemp(prefix=name + '@',
+                                              dir=reserved)
+                os.close(fd)
+                markers.append(marker)
+        except (OSError, TracError), e:
+            self.log.warning("Can't reserve repository names: %s",
+                             exception_to_unicode(e))
+        return markers
+
+    def _release(self, markers):
+        for marker in markers:
+            try:
+                os.unlink(marker)
+            except OSError:
+                pass
+
+    def _create_repository(self, name):
+        """Create repository directory without reloading repository
+        manager."""
+        if not name or name.startswith('.') or '/' in name or os.sep in name:
+            raise TracError(_('Invalid repository name "%(name)s".',
+                              name=name))
         dir = os.path.join(self.parentpath, name)
         if not os.path.isabs(dir):
             raise TracError(_("The repository directory must be absolute"))
-        trunk = os.path.join(dir, 'trunk')
-        branches = os.path.join(dir, 'branches')
-        tags = os.path.join(dir, 'tags')
-        command = u'"{svnadmin}" create "{dir}"'
-        if self.create_base_structure:
-            command += '; "{svn}" mkdir --parents -q -m "Created Folders" "file://{trunk}" "file://{branches}" "file://{tags}"'
-        if self.chmod:
-            command += '; chmod {chmod} "{dir}"'
-        command = command.format(
-            svnadmin=self.svnadmin,
-            dir=dir,
-            svn=self.svnclient,
-            trunk=trunk,
-            branches=branches,
-            tags=tags,
-            chmod=self.chmod,
-        )
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (result, error) = process.communicate()
-        if error is not None and error != "":
-            if error.find('E165002') > -1:
+        if self.use_skeleton:
+            self._create_from_skeleton(name, dir)
+        else:
+            self._create_repository_dir(name, dir)
+        self.invalidate_cache()
+
+    def _create_repository_dir(self, name, dir):
+        backend = self.get_backend()
+        try:
+            backend.create(dir)
+            if self.create_base_structure:
+                backend.mkdir(dir, ('trunk', 'branches', 'tags'),
+                              'Created Folders')
+        except SvnBackendError, e:
+            if e.code == 165002:
                 raise TracError(_('The repository "%(name)s" already exists.', name=name))
-            elif error.find('E000002') > -1 or error.find('E000013') > -1:
+            elif e.code in (2, 13):
                 raise TracError(_("Can't create the repository '%(name)s.' "
                                   "Make sure the parent directory '%(parentpath)s' exists "
                                   "and the web server has write permissions for it.", name=name, parentpath=self.parentpath))
             else:
+                raise TracError(e.message)
+        if self.chmod:
+            args = ['chmod'] + shlex.split(self.chmod) + [dir]
+            with SvnOperationTimer(self.env).timed('chmod') as t:
+                process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE)
+                (result, error) = process.communicate()
+                t.exit_code = process.returncode
+                t.size = len(result) + len(error)
+            if process.returncode != 0:
                 raise TracError(error)
         if self.hookspath and os.path.exists(self.hookspath):
-            hooksdir = os.path.join(dir, 'hooks/')
-            files = os.listdir(self.hookspath)
-            files = [os.path.join(self.hookspath, filename) for filename in files]
-            for f in files:
-                shutil.copy2(f, hooksdir)
-        rm = RepositoryManager(self.env)
-        rm.reload_repositories()
-    
+            hooksdir = os.path.join(dir, 'hooks')
+            for filename in os.listdir(self.hookspath):
+                self._install_hook(os.path.join(self.hookspath, filename),
+                                   os.path.join(hooksdir, filename))
+
+    # Hooks
+
+    def sync_hooks(self, dry_run=False):
+        """Update hooks of all repositories which differ from hooks in
+        `hooks_path`. Repositories are processed in parallel.
+
+        Return tuple (dict of repository names and lists of changed hook
+        names, dict of repository names and error strings).
+        With `dry_run` only find out what would be changed.
+        """
+        if not self.hookspath or not os.path.isdir(self.hookspath):
+            raise TracError(_('Hooks directory is not set or does not exist'))
+        sources = {}
+        for filename in os.listdir(self.hookspath):
+            path = os.path.join(self.hookspath, filename)
+            if os.path.isfile(path):
+                sources[filename] = (path, os.path.getsize(path),
+                                     _file_checksum(path))
+
+        def sync(name):
+            hooksdir = os.path.join(self.parentpath, name, 'hooks')
+            changed = []
+            try:
+                for filename, (src, size, checksum) in sources.iteritems():
+                    dst = os.path.join(hooksdir, filename)
+                    if self._hook_is_current(src, size, checksum, dst):
+                        continue
+                    changed.append(filename)
+                    if not dry_run:
+                        self._install_hook(src, dst)
+            except (IOError, OSError), e:
+                return name, sorted(changed), exception_to_unicode(e)
+            return name, sorted(changed), None
+
+        pool = ThreadPool(max(1, self.create_workers))
+        try:
+            results = pool.map(sync, self.get_repository_names())
+        finally:
+            pool.close()
+            pool.join()
+        changes = dict((name, changed) for name, changed, err in results
+                       if changed)
+        errors = dict((name, err) for name, changed, err in results if err)
+        return changes, errors
+
+    def _hook_is_current(self, src, size, checksum, dst):
+        if self.hooks_link:
+            return os.path.islink(dst) and os.readlink(dst) == src
+        try:
+            if os.path.islink(dst) or os.path.getsize(dst) != size:
+                return False
+        except OSError:
+            return False  # missing
+        return _file_checksum(dst) == checksum
+
+    def _install_hook(self, src, dst):
+        """Copy or link hook `src` to `dst` replacing it atomically."""
+        tmp = '%s.tmp-%d' % (dst, os.getpid())
+        if self.hooks_link:
+            os.symlink(src, tmp)
+        else:
+            with SvnOperationTimer(self.env).timed('install hook') as t:
+                shutil.copy2(src, tmp)
+                t.size = os.path.getsize(tmp)
+        try:
+            os.rename(tmp, dst)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    # Skeleton repositories
+
+    def rebuild_skeleton(self):
+        """Create skeleton repository anew and drop pre-created
+        repositories made from the old one."""
+        sigfile = os.path.join(self.parentpath, WORK_DIR, 'skeleton.sig')
+        try:
+            os.unlink(sigfile)
+        except OSError:
+            pass
+        return self._get_skeleton()
+
+    def _get_skeleton_signature(self):
+        hooks = []
+        if self.hookspath and os.path.isdir(self.hookspath):
+            for filename in sorted(os.listdir(self.hookspath)):
+                st = os.stat(os.path.join(self.hookspath, filename))
+                hooks.append((filename, st.st_mtime, st.st_size))
+        return repr((self.get_backend().name, self.svnadmin, self.svnclient,
+                     self.create_base_structure, self.chmod, self.hookspath, self.hooks_link, hooks))
+
+    def _get_skeleton(self):
+        """Return path of up to date skeleton repository, build it if
+        needed."""
+        workdir = self.get_work_dir()
+        skeleton = os.path.join(workdir, 'skeleton')
+        sigfile = skeleton + '.sig'
+        signature = self._get_skeleton_signature()
+        with FileLock(skeleton):
+            try:
+                fp = open(sigfile, 'rb')
+                try:
+                    current = fp.read()
+                finally:
+                    fp.close()
+            except IOError:
+                current = None
+            if current != signature or not os.path.isdir(skeleton):
+                self._build_skeleton(workdir)
+                with SvnOperationTimer(self.env).timed('write skeleton '
+                                                       'signature'):
+                    atomic_write(sigfile, signature)
+        return skeleton
+
+    def _build_skeleton(self, workdir):
+        skeleton = os.path.join(workdir, 'skeleton')
+        pool = os.path.join(workdir, 'pool')
+        for path in (skeleton, pool):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        self._create_repository_dir('skeleton', skeleton)
+        os.mkdir(pool)
+        self.log.info('Skeleton repository %s has been built', skeleton)
+
+    def _copy_skeleton(self, skeleton, dir, name=None):
+        """Copy skeleton repository to `dir` and give it a new UUID.
+        Caller must hold shared `FileLock` of the skeleton."""
+        try:
+            with SvnOperationTimer(self.env).timed('copy skeleton'):
+                shutil.copytree(skeleton, dir, symlinks=True)
+                shutil.copystat(skeleton, dir)
+        except (IOError, OSError, shutil.Error), e:
+            shutil.rmtree(dir, ignore_errors=True)
+            raise TracError(_("Can't create the repository '%(name)s.' "
+                              "Make sure the parent directory '%(parentpath)s' exists "
+                              "and the web server has write permissions for it.",
+                              name=name or os.path.basename(dir),
+                              parentpath=self.parentpath))
+        try:
+            self.get_backend().setuuid(dir)
+        except SvnBackendError, e:
+            shutil.rmtree(dir, ignore_errors=True)
+            raise TracError(e.message)
+
+    def _create_from_skeleton(self, name, dir):
+        skeleton = self._get_skeleton()
+        workdir = os.path.dirname(skeleton)
+        pool = os.path.join(workdir, 'pool')
+        # reserve the name, an empty directory is then replaced by rename
+        try:
+            os.mkdir(dir)
+        except OSError, e:
+            if e.errno == errno.EEXIST:
+                raise TracError(_('The repository "%(name)s" already exists.', name=name))
+            raise TracError(_("Can't create the repository '%(name)s.' "
+                              "Make sure the parent directory '%(parentpath)s' exists "
+                              "and the web server has write permissions for it.", name=name, parentpath=self.parentpath))
+        try:
+            try:
+                ready = os.listdir(pool)
+            except OSError:
+                ready = []
+            for item in ready:
+                if item.startswith('.'):
+                    continue  # not finished yet
+                try:
+                    os.rename(os.path.join(pool, item), dir)
+                    break
+                except OSError, e:
+                    if e.errno != errno.ENOENT:
+                        raise TracError(exception_to_unicode(e))
+                    # taken by another worker
+            else:
+                tmp = tempfile.mkdtemp(prefix='.new-', dir=workdir)
+                os.rmdir(tmp)
+                with FileLock(skeleton, shared=True):
+                    self._copy_skeleton(skeleton, tmp, name)
+                try:
+                    os.rename(tmp, dir)
+                except OSError, e:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    raise TracError(exception_to_unicode(e))
+        except:
+            try:
+                os.rmdir(dir)  # only if still reserved and empty
+            except OSError:
+                pass
+            raise
+        if self.skeleton_pool_size > 0:
+            self._pool_thread.start()
+
+    def _refill_pool(self):
+        skeleton = os.path.join(self.parentpath, WORK_DIR, 'skeleton')
+        pool = os.path.join(os.path.dirname(skeleton), 'pool')
+        try:
+            while True:
+                # the skeleton must not be rebuilt while it is copied
+                with FileLock(skeleton, shared=True):
+                    if not os.path.isdir(pool) or \
+                            len(os.listdir(pool)) >= self.skeleton_pool_size:
+                        break
+                    tmp = tempfile.mkdtemp(prefix='.new-', dir=pool)
+                    os.rmdir(tmp)
+                    self._copy_skeleton(skeleton, tmp)
+                    os.rename(tmp, os.path.join(pool,
+                                                os.path.basename(tmp)[1:]))
+        except Exception, e:
+            self.log.error('Failed to fill repository pool: %s',
+                           exception_to_unicode(e))
+
     def remove_repository(self, name):
         """Remove a repository."""
-        try:
+        err = self.remove_repositories([name], unregister=False)[name]
+        if err:
+            raise TracError(err)
+
+    def remove_repositories(self, names, unregister=True):
+        """Remove many repositories at once.
+
+        Repository directories are moved to trash directory inside
+        parent path, unregistered from `DbRepositoryProvider` (if
+        `unregister` is True, see `unregister_repositories`) and
+        repository manager is reloaded once. Trash is deleted in the background after
+        `trash_retention` hours.
+        Return dict with None on success or error string on fail
+        for each repository name.
+        """
+        trash = os.path.join(self.parentpath, WORK_DIR, 'trash')
+        results = OrderedDict()
+        removed = []
+        for name in names:
             dir = os.path.join(self.parentpath, name)
-            shutil.rmtree(dir)
-            rm = RepositoryManager(self.env)
-            rm.reload_repositories()
-        except OSError, e:
-            raise TracError(exception_to_unicode(e))
+            if not name or name.startswith('.') or not os.path.isdir(dir):
+                results[name] = _('The repository "%(name)s" does not exist.',
+                                  name=name)
+                continue
+            try:
+                if not os.path.isdir(trash):
+                    os.makedirs(trash)
+                # microseconds keep entries of the same name unique
+                os.rename(dir, os.path.join(trash, '%s@%.6f'
+                                                   % (name, time.time())))
+            except OSError, e:
+                results[name] = exception_to_unicode(e)
+                continue
+            self.invalidate_cache(name)
+            results[name] = None
+            removed.append(name)
+        if removed:
+            self.invalidate_cache()
+
+        if removed:
+            if unregister:
+                self.unregister_repositories(removed)
+            else:
+                RepositoryManager(self.env).reload_repositories()
+            self._purge_thread.start()
+        return results
+
+    def unregister_repositories(self, names):
+        """Remove repositories from `DbRepositoryProvider` together
+        with their cached changesets in a single transaction and reload
+        repository manager once."""
+        @self.env.with_transaction()
+        def do_unregister(db):
+            cursor = db.cursor()
+            for name in names:
+                cursor.execute("SELECT id FROM repository "
+                               "WHERE name='name' AND value=%s", (name,))
+                row = cursor.fetchone()
+                if not row:
+                    continue
+                id = row[0]
+                cursor.execute("DELETE FROM repository WHERE id=%s", (id,))
+                cursor.execute("DELETE FROM revision WHERE repos=%s", (id,))
+                cursor.execute("DELETE FROM node_change WHERE repos=%s",
+                               (id,))
+        RepositoryManager(self.env).reload_repositories()
+
+    def get_trash(self):
+        """Return list of (trash entry, repository name, removal time)
+        of removed repositories which can still be restored."""
+        trash = os.path.join(self.parentpath, WORK_DIR, 'trash')
+        try:
+            entries = os.listdir(trash)
+        except OSError:
+            return []
+        result = []
+        for entry in sorted(entries):
+            name, sep, ts = entry.rpartition('@')
+            if sep and ts.replace('.', '', 1).isdigit():
+                result.append((entry, name,
+                               datetime.fromtimestamp(float(ts), utc)))
+        return result
+
+    def restore_repository(self, entry, project_id=0):
+        """Move removed repository back from trash and register it."""
+        name = entry.rpartition('@')[0]
+        src = os.path.join(self.parentpath, WORK_DIR, 'trash', entry)
+        dir = os.path.join(self.parentpath, name)
+        if not name or not os.path.isdir(src):
+            raise TracError(_('There is no "%(entry)s" in trash.',
+                              entry=entry))
+        if os.path.exists(dir):
+            raise TracError(_('The repository "%(name)s" already exists.',
+                              name=name))
+        markers = self._reserve([name])
+        try:
+            try:
+                os.rename(src, dir)
+            except OSError, e:
+                raise TracError(exception_to_unicode(e))
+            self.invalidate_cache()
+            self.register_repositories([(name, project_id)])
+        finally:
+            self._release(markers)
+        return name
+
+    def _purge_trash(self):
+        trash = os.path.join(self.parentpath, WORK_DIR, 'trash')
+        failures = 0
+        try:
+            while True:
+                entries = self.get_trash()
+                if not entries:
+                    break
+                deadline = datetime.now(utc) - \
+                           timedelta(hours=max(0, self.trash_retention))
+                failed = False
+                for entry, name, removed in entries:
+                    if removed > deadline:
+                        continue
+                    path = os.path.join(trash, entry)
+                    errors = []
+                    shutil.rmtree(path, onerror=lambda fn, p, exc_info:
+                                                errors.append(exc_info[1]))
+                    if os.path.exists(path):
+                        failed = True
+                        self.log.error('Failed to purge removed repository '
+                                       '%s from trash: %s', name,
+                                       exception_to_unicode(errors[0])
+                                       if errors else path)
+                    else:
+                        self.log.info('Removed repository %s has been '
+                                      'purged from trash', name)
+                failures = failures + 1 if failed else 0
+                interval = 60 if self.trash_retention > 0 else 1
+                # back off while entries can't be removed
+                if not self._purge_thread.wait(
+                        min(interval * 2 ** min(failures, 12),
+                            MAX_PURGE_BACKOFF)):
+                    break
+        except Exception, e:
+            self.log.error('Failed to purge repository trash: %s',
+                           exception_to_unicode(e))
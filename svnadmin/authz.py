@@ -0,0 +1,512 @@
+# SVNAdmin plugin
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from trac.admin import IAdminCommandProvider
+from trac.core import *
+from trac.util.text import exception_to_unicode, print_table, to_unicode
+from trac.util.translation import _
+
+from svnadmin.timing import SvnOperationTimer
+from svnadmin.util import atomic_write, read_file, update_file
+
+
+_section_re = re.compile(r'^\[(?P<name>[^\]]+)\]\s*$')
+_entry_re = re.compile(r'^(?P<key>[^:=\s][^:=]*?)\s*[:=]\s*(?P<value>.*?)\s*$')
+
+
+class AuthzSyntaxError(ValueError):
+    """Error in authz file syntax."""
+
+
+class AuthzFile(object):
+    '''Parsed authz file.
+
+    Original lines are kept, so editing methods change only lines of
+    the affected entries and comments and formatting are preserved.
+    Section names are kept as is, e.g. `groups`, `aliases`, `/path`
+    or `repos:/path`.
+    '''
+
+    def __init__(self, text=''):
+        self.lines = text.splitlines()
+        self._parse()
+
+    def __str__(self):
+        return '\n'.join(self.lines) + '\n' if self.lines else ''
+
+    def _parse(self):
+        sections = OrderedDict()
+        section = None
+        entry = None  # (key, start) of entry continuation lines belong to
+        for idx, line in enumerate(self.lines):
+            stripped = line.strip()
+            if not stripped or line[0] in '#;':
+                continue
+            if line[0].isspace() and entry is not None:
+                # continuation line, appended to the previous value
+                key, start = entry
+                value = section[key][2]
+                section[key] = (start, idx + 1,
+                                value + '\n' + stripped if value
+                                else stripped)
+                continue
+            if stripped[0] in '#;':
+                continue
+            match = _section_re.match(stripped)
+            if match:
+                name = match.group('name').strip()
+                if name not in sections:
+                    sections[name] = (idx, OrderedDict())
+                section = sections[name][1]
+                entry = None
+                continue
+            match = _entry_re.match(stripped)
+            if not match:
+                raise AuthzSyntaxError('Invalid line %d: %s' % (idx + 1, line))
+            if section is None:
+                raise AuthzSyntaxError('Entry outside of section at line %d'
+                                       % (idx + 1))
+            key = match.group('key')
+            section[key] = (idx, idx + 1, match.group('value'))
+            entry = (key, idx)
+        self._sections = sections
+
+    # Query methods
+
+    def sections(self):
+        return self._sections.keys()
+
+    def has_section(self, section):
+        return section in self._sections
+
+    def items(self, section):
+        '''Return list of (key, value) pairs of section.'''
+        if section not in self._sections:
+            return []
+        return [(key, value) for key, (start, end, value)
+                in self._sections[section][1].iteritems()]
+
+    def get(self, section, key, default=None):
+        entry = self._entry(section, key)
+        return entry[2] if entry else default
+
+    def groups(self):
+        '''Return dict of group names and lists of their members.'''
+        return dict((group, _split_members(value))
+                    for group, value in self.items('groups'))
+
+    def aliases(self):
+        return dict(self.items('aliases'))
+
+    def rules(self):
+        '''Return dict of path sections and lists of (who, permission)
+        pairs.'''
+        return dict((section, self.items(section))
+                    for section in self._sections
+                    if section not in ('groups', 'aliases'))
+
+    # Editing methods
+
+    def set(self, section, key, value):
+        '''Set entry value. Append section to the end of file if it
+        doesn't exist.'''
+        line = '%s = %s' % (key, value)
+        if section not in self._sections:
+            if self.lines and self.lines[-1].strip():
+                self.lines.append('')
+            self.lines.extend(['[%s]' % section, line])
+        else:
+            header, entries = self._sections[section]
+            if key in entries:
+                start, end = entries[key][:2]
+                self.lines[start:end] = [line]
+            else:
+                # after the last entry of the section
+                end = max([header + 1] + [entry[1] for entry
+                                          in entries.itervalues()])
+                self.lines.insert(end, line)
+        self._parse()
+
+    def remove(self, section, key):
+        '''Remove entry. Return False if it doesn't exist.'''
+        entry = self._entry(section, key)
+        if not entry:
+            return False
+        del self.lines[entry[0]:entry[1]]
+        self._parse()
+        return True
+
+    def remove_section(self, section):
+        '''Remove section with all its entries and comments.
+        Return False if it doesn't exist.'''
+        if section not in self._sections:
+            return False
+        start = self._sections[section][0]
+        end = start + 1
+        while end < len(self.lines) and \
+                not _section_re.match(self.lines[end].strip()):
+            end += 1
+        del self.lines[start:end]
+        self._parse()
+        return True
+
+    def add_rule(self, section, who, permission):
+        self.set(section, who, permission)
+
+    def remove_rule(self, section, who):
+        return self.remove(section, who)
+
+    def add_group_member(self, group, member):
+        '''Add member to group. Return False if it is already a member.'''
+        members = _split_members(self.get('groups', group, ''))
+        if member in members:
+            return False
+        members.append(member)
+        self.set('groups', group, ', '.join(members))
+        return True
+
+    def remove_group_member(self, group, member):
+        '''Remove member from group. Return False if it isn't a member.'''
+        members = _split_members(self.get('groups', group, ''))
+        if member not in members:
+            return False
+        members.remove(member)
+        self.set('groups', group, ', '.join(members))
+        return True
+
+    def _entry(self, section, key):
+        if section not in self._sections:
+            return None
+        return self._sections[section][1].get(key)
+
+
+def _split_members(value):
+    return [m.strip() for m in value.split(',') if m.strip()]
+
+
+class _PathNode(object):
+
+    __slots__ = ('children', 'rules')
+
+    def __init__(self):
+        self.children = {}
+        self.rules = None  # list of (matcher, permission) of section
+
+
+class AuthzEvaluator(object):
+    '''Compiled authz rules answering "what can user do on repos:/path".
+
+    Nested groups and aliases are expanded once. Rules are indexed by
+    repository and path components, so a lookup visits only the nodes
+    on the path from root to the requested path.
+    '''
+
+    def __init__(self, authz):
+        self.aliases = authz.aliases()
+        self._group_members = self._expand_groups(authz.groups())
+        self._user_groups = {}
+        for group, members in self._group_members.iteritems():
+            for member in members:
+                self._user_groups.setdefault(member, set()).add(group)
+        self._rule_users = set()
+        self._roots = {}  # repos name (None for all) -> _PathNode
+        for section, rules in authz.rules().iteritems():
+            if ':' in section:
+                repos, path = section.split(':', 1)
+            else:
+                repos, path = None, section
+            if not path.startswith('/'):
+                continue
+            node = self._roots.setdefault(repos, _PathNode())
+            for part in _path_parts(path):
+                node = node.children.setdefault(part, _PathNode())
+            node.rules = [(self._compile(who), perm.strip())
+                          for who, perm in rules]
+
+    def _expand_groups(self, groups):
+        expanded = {}
+        def expand(group, stack):
+            if group in expanded:
+                return expanded[group]
+            users = set()
+            if group in stack:
+                return users  # cyclic definition
+            stack.add(group)
+            for member in groups.get(group, ()):
+                if member.startswith('@'):
+                    users |= expand(member[1:], stack)
+                elif member.startswith('&'):
+                    users.add(self.aliases.get(member[1:], member))
+                else:
+                    users.add(member)
+            stack.discard(group)
+            expanded[group] = users
+            return users
+        for group in groups:
+            expand(group, set())
+        return dict((g, frozenset(u)) for g, u in expanded.iteritems())
+
+    def _compile(self, who):
+        who = who.strip()
+        negate = who.startswith('~')
+        if negate:
+            who = who[1:]
+        if who == '*':
+            match = lambda user, groups: True
+        elif who == '$anonymous':
+            match = lambda user, groups: user is None
+        elif who == '$authenticated':
+            match = lambda user, groups: user is not None
+        elif who.startswith('@'):
+            group = who[1:]
+            match = lambda user, groups: group in groups
+        else:
+            if who.startswith('&'):
+                who = self.aliases.get(who[1:], who)
+            self._rule_users.add(who)
+            match = lambda user, groups: user == who
+        if negate:
+            return lambda user, groups: not match(user, groups)
+        return match
+
+    # Public API
+
+    def get_groups(self, user):
+        '''Return set of groups (including nested ones) of user.'''
+        return self._user_groups.get(user, frozenset())
+
+    def get_group_members(self, group):
+        return self._group_members.get(group, frozenset())
+
+    def get_users(self):
+        '''Return set of users mentioned in groups and rules.'''
+        return set(self._user_groups) | self._rule_users
+
+    def get_permission(self, user, repos, path='/'):
+        '''Return permission string (`rw`, `r` or empty) of `user`
+        (None for anonymous) on `repos:path`.'''
+        groups = self.get_groups(user)
+        chain = []
+        for root in (self._roots.get(None), self._roots.get(repos)):
+            nodes = []
+            node = root
+            if node is not None:
+                nodes.append(node)
+                for part in _path_parts(path):
+                    node = node.children.get(part)
+                    if node is None:
+                        break
+                    nodes.append(node)
+            chain.append(nodes)
+        global_nodes, repos_nodes = chain
+        # most specific path wins, repository section before global one
+        for depth in xrange(max(len(global_nodes), len(repos_nodes)) - 1,
+                            -1, -1):
+            for nodes in (repos_nodes, global_nodes):
+                if depth >= len(nodes) or nodes[depth].rules is None:
+                    continue
+                perms = [perm for match, perm in nodes[depth].rules
+                         if match(user, groups)]
+                if perms:
+                    if any('w' in perm for perm in perms):
+                        return 'rw'
+                    if any('r' in perm for perm in perms):
+                        return 'r'
+                    return ''
+        return ''
+
+    def get_permissions_matrix(self, users, repositories, path='/'):
+        '''Return dict {user: {repos: permission}} for all combinations
+        of `users` and `repositories`.'''
+        return dict((user, dict((repos, self.get_permission(user, repos, path))
+                                for repos in repositories))
+                    for user in users)
+
+
+def _path_parts(path):
+    return [part for part in path.split('/') if part]
+
+
+class SvnAuthzManager(Component):
+    """Component providing parsed authz file configured by
+    `[trac] authz_file` option.
+
+    Parsed file is cached until the file is changed on disk. All
+    modifications are written back atomically under a file lock (see
+    `update_file`).
+    """
+
+    implements(IAdminCommandProvider)
+
+    def __init__(self):
+        self._cache = None  # (path, stamp, AuthzFile)
+        self._evaluator = None  # (AuthzFile, AuthzEvaluator)
+        self._lock = threading.Lock()
+        # set by `SvnAdminWatcher`, the file is then read again only
+        # after `invalidate_cache()`
+        self.watched = False
+
+    @property
+    def authz_file(self):
+        return self.config.get('trac', 'authz_file')
+
+    # Public API
+
+    def get_authz(self):
+        """Return parsed authz file. Returned object must not be
+        modified, use `update` instead."""
+        path = self.authz_file
+        with self._lock:
+            cache = self._cache
+        if self.watched and cache and cache[0] == path:
+            return cache[2]
+        stamp = self._get_stamp(path)
+        if cache and cache[0] == path and cache[1] == stamp:
+            return cache[2]
+        authz = self._read(path)
+        with self._lock:
+            self._cache = (path, stamp, authz)
+        return authz
+
+    def invalidate_cache(self):
+        """Read the authz file again on the next access."""
+        with self._lock:
+            self._cache = None
+
+    def get_evaluator(self):
+        """Return `AuthzEvaluator` compiled from current authz file."""
+        authz = self.get_authz()
+        cached = self._evaluator
+        if cached and cached[0] is authz:
+            return cached[1]
+        evaluator = AuthzEvaluator(authz)
+        self._evaluator = (authz, evaluator)
+        return evaluator
+
+    def get_permission(self, user, repos, path='/'):
+        """Return permission (`rw`, `r` or empty string) of `user` on
+        `repos:path`."""
+        return self.get_evaluator().get_permission(user, repos, path)
+
+    def get_text(self):
+        """Return tuple (contents of authz file, version token). The token
+        can be passed to `save_text` to detect concurrent changes."""
+        try:
+            return read_file(self.authz_file)
+        except IOError, e:
+            raise TracError(_("Can't read authz file: %(error)s",
+                              error=exception_to_unicode(e)))
+
+    def update(self, fn):
+        """Call `fn(authz)` with freshly parsed authz file and write it
+        back unless `fn` returns False. Return value returned by `fn`."""
+        result = []
+        def do_update(text):
+            authz = self._parse(text)
+            result.append(fn(authz))
+            if result[0] is not False:
+                return authz
+        self._update(do_update)
+        return result[0]
+
+    def save_text(self, text, version=None):
+        """Validate and write whole authz file contents.
+
+        With `version` token (see `get_text`) `ConcurrentUpdateError` is
+        raised when the file has been changed in the meantime."""
+        authz = self._parse(text)
+        self._update(lambda text: authz, version)
+
+    def add_rule(self, section, who, permission):
+        self.update(lambda authz: authz.add_rule(section, who, permission))
+
+    def remove_rule(self, section, who):
+        return self.update(lambda authz: authz.remove_rule(section, who))
+
+    def add_group_member(self, group, member):
+        return self.update(lambda authz:
+                           authz.add_group_member(group, member))
+
+    def remove_group_member(self, group, member):
+        return self.update(lambda authz:
+                           authz.remove_group_member(group, member))
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('svnadmin authz matrix', '[path] [repos] [...]',
+               """Print effective permissions of all users on repositories
+
+               Users are taken from authz file groups and rules. If no
+               repositories are given all repositories in the parent
+               directory are listed.
+               """,
+               None, self._do_matrix)
+
+    def _do_matrix(self, path='/', *repositories):
+        from svnadmin.api import SvnRepositoryProvider
+        evaluator = self.get_evaluator()
+        if not repositories:
+            provider = self.env[SvnRepositoryProvider]
+            repositories = [name for name, repo in provider.get_repositories()]
+        repositories = sorted(repositories)
+        users = sorted(evaluator.get_users())
+        matrix = evaluator.get_permissions_matrix(users, repositories, path)
+        print_table([[user] + [matrix[user][repos] or '-'
+                               for repos in repositories]
+                     for user in users],
+                    ['User'] + repositories)
+
+    # Internal methods
+
+    def _get_stamp(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def _update(self, fn, version=None):
+        """Update authz file by `fn(text)` returning `AuthzFile` to write
+        or None."""
+        path = self.authz_file
+        written = []
+        def do_update(text):
+            authz = fn(text)
+            if authz is not None:
+                written.append(authz)
+                return str(authz)
+        def write(path, data):
+            with SvnOperationTimer(self.env).timed('write authz', len(data)):
+                atomic_write(path, data)
+        try:
+            update_file(path, do_update, version, write)
+        except (IOError, OSError), e:
+            raise TracError(_("Can't write authz file: %(error)s",
+                              error=exception_to_unicode(e)))
+        if written:
+            with self._lock:
+                self._cache = (path, self._get_stamp(path), written[0])
+
+    def _parse(self, text):
+        try:
+            return AuthzFile(text)
+        except AuthzSyntaxError, e:
+            raise TracError(_('Invalid Syntax: %(error)s',
+                              error=to_unicode(e)))
+
+    def _read(self, path):
+        try:
+            fp = open(path, 'rb')
+            try:
+                text = fp.read()
+            finally:
+                fp.close()
+        except IOError, e:
+            raise TracError(_("Can't read authz file: %(error)s",
+                              error=exception_to_unicode(e)))
+        return self._parse(text)
@@ -0,0 +1,165 @@
+# SVNAdmin plugin
+
+import getpass
+import os
+import os.path
+import re
+import subprocess
+import time
+import urllib
+
+from trac.util.text import exception_to_unicode, to_unicode
+
+try:
+    from svn import core as svn_core, fs as svn_fs, repos as svn_repos
+    has_bindings = True
+except ImportError:
+    has_bindings = False
+
+
+_error_code_re = re.compile(r'\bE(\d{6})\b')
+
+
+class SvnBackendError(Exception):
+    '''Failed Subversion operation. `code` is the Subversion / APR error
+    number (e.g. 165002 for an existing repository) when known.'''
+
+    def __init__(self, message, code=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.code = code
+
+
+def _file_url(path):
+    return 'file://' + urllib.pathname2url(os.path.abspath(path))
+
+
+class SubprocessBackend(object):
+    '''Subversion operations performed by `svnadmin`, `svn` and `svnlook`
+    executables. Arguments are passed as lists, no shell is involved.'''
+
+    name = 'subprocess'
+
+    def __init__(self, svnadmin, svn, svnlook, timer=None):
+        self.svnadmin = svnadmin
+        self.svn = svn
+        self.svnlook = svnlook
+        self.timer = timer
+
+    def create(self, dir):
+        self._call((self.svnadmin, 'create', dir))
+
+    def youngest(self, dir):
+        output = self._call((self.svnlook, 'youngest', dir))
+        try:
+            return int(output.strip())
+        except ValueError:
+            raise SvnBackendError('Unexpected svnlook output: %s'
+                                  % to_unicode(output.strip()))
+
+    def mkdir(self, dir, paths, message):
+        urls = [_file_url(os.path.join(dir, path)) for path in paths]
+        self._call((self.svn, 'mkdir', '--parents', '-q', '-m', message)
+                   + tuple(urls))
+
+    def setuuid(self, dir):
+        self._call((self.svnadmin, 'setuuid', dir))
+
+    def verify(self, dir, start, end):
+        self._call((self.svnadmin, 'verify', '-q',
+                    '-r', '%d:%d' % (start, end), dir))
+
+    def _call(self, args):
+        start = time.time()
+        try:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE)
+            (result, error) = process.communicate()
+        except OSError, e:
+            self._record(args, start, -1, None)
+            raise SvnBackendError('Error occurred while calling %s: %s'
+                                  % (os.path.basename(args[0]),
+                                     exception_to_unicode(e)))
+        self._record(args, start, process.returncode,
+                     len(result) + len(error))
+        if process.returncode != 0:
+            error = to_unicode(error.strip())
+            match = _error_code_re.search(error)
+            raise SvnBackendError(error,
+                                  int(match.group(1)) if match else None)
+        return result
+
+    def _record(self, args, start, exit_code, size):
+        if self.timer is not None:
+            operation = '%s %s' % (os.path.basename(args[0]), args[1])
+            self.timer.record(operation, time.time() - start, exit_code,
+                              size)
+
+
+class BindingsBackend(object):
+    '''Subversion operations performed in-process by `svn.repos` and
+    `svn.fs` Python bindings. Every operation uses its own memory pool.'''
+
+    name = 'bindings'
+
+    def __init__(self, timer=None):
+        self.timer = timer
+
+    def create(self, dir):
+        def do_create(pool):
+            svn_repos.create(dir, '', '', None, None, pool)
+        self._run('create', do_create)
+
+    def youngest(self, dir):
+        def do_youngest(pool):
+            repos = svn_repos.open(dir, pool)
+            return svn_fs.youngest_rev(svn_repos.fs(repos), pool)
+        return self._run('youngest', do_youngest)
+
+    def mkdir(self, dir, paths, message):
+        author = getpass.getuser()
+        def do_mkdir(pool):
+            repos = svn_repos.open(dir, pool)
+            fs = svn_repos.fs(repos)
+            rev = svn_fs.youngest_rev(fs, pool)
+            txn = svn_repos.fs_begin_txn_for_commit(repos, rev, author,
+                                                    message, pool)
+            root = svn_fs.txn_root(txn, pool)
+            for path in paths:
+                # like `svn mkdir --parents`
+                current = ''
+                for part in path.strip('/').split('/'):
+                    current = current + '/' + part if current else part
+                    if svn_fs.check_path(root, current, pool) == \
+                            svn_core.svn_node_none:
+                        svn_fs.make_dir(root, current, pool)
+            svn_repos.fs_commit_txn(repos, txn, pool)
+        self._run('mkdir', do_mkdir)
+
+    def setuuid(self, dir):
+        def do_setuuid(pool):
+            repos = svn_repos.open(dir, pool)
+            svn_fs.set_uuid(svn_repos.fs(repos), None, pool)
+        self._run('setuuid', do_setuuid)
+
+    def verify(self, dir, start, end):
+        def do_verify(pool):
+            repos = svn_repos.open(dir, pool)
+            svn_repos.verify_fs2(repos, start, end, None, None, pool)
+        self._run('verify', do_verify)
+
+    def _run(self, operation, fn):
+        start = time.time()
+        exit_code = 0
+        pool = svn_core.Pool()
+        try:
+            return fn(pool)
+        except svn_core.SubversionException, e:
+            exit_code = getattr(e, 'apr_err', None) or -1
+            raise SvnBackendError(to_unicode(e.args[0]),
+                                  getattr(e, 'apr_err', None))
+        finally:
+            pool.destroy()
+            if self.timer is not None:
+                self.timer.record('bindings ' + operation,
+                                  time.time() - start, exit_code)
@@ -0,0 +1,99 @@
+# SVNAdmin plugin
+
+from trac.core import *
+from trac.db import Table, Column, Index, DatabaseManager
+from trac.env import IEnvironmentSetupParticipant
+
+
+schema_version = 4
+
+# (version the table was introduced in, table)
+schema = [
+    (1, Table('svnadmin_verification', key='repos')[
+        Column('repos'),
+        Column('verified_rev', type='int'),
+        Column('status'),
+        Column('message'),
+        Column('time', type='int64'),
+    ]),
+    (2, Table('svnadmin_replication_queue', key='id')[
+        Column('id', auto_increment=True),
+        Column('username'),
+        Column('action'),
+        Column('hash'),
+        Column('time', type='int64'),
+    ]),
+    (3, Table('svnadmin_repository_stats', key='repos')[
+        Column('repos'),
+        Column('size', type='int64'),
+        Column('revisions', type='int'),
+        Column('last_commit', type='int64'),
+        Column('prev_size', type='int64'),
+        Column('scan_time', type='int64'),
+    ]),
+    (3, Table('svnadmin_repository_shards', key=('repos', 'shard'))[
+        Column('repos'),
+        Column('shard'),
+        Column('mtime', type='int64'),
+        Column('size', type='int64'),
+    ]),
+]
+
+# (version the index was introduced in, table, indexed columns) of
+# indexes added to tables which are not owned by this plugin
+indexes = [
+    # lookup of repositories by attribute, e.g. `project_id`
+    (4, 'repository', ('name', 'value')),
+]
+
+
+class SvnAdminSetup(Component):
+    """Component creating and upgrading SVNAdmin database tables."""
+
+    implements(IEnvironmentSetupParticipant)
+
+    # IEnvironmentSetupParticipant methods
+
+    def environment_created(self):
+        @self.env.with_transaction()
+        def do_create(db):
+            self._upgrade(db, 0)
+
+    def environment_needs_upgrade(self, db):
+        return self._get_version(db) < schema_version
+
+    def upgrade_environment(self, db):
+        self._upgrade(db, self._get_version(db))
+
+    # Internal methods
+
+    def _get_version(self, db):
+        cursor = db.cursor()
+        cursor.execute("SELECT value FROM system WHERE name='svnadmin_version'")
+        row = cursor.fetchone()
+        return row and int(row[0]) or 0
+
+    def _upgrade(self, db, version):
+        connector, _ = DatabaseManager(self.env)._get_connector()
+        cursor = db.cursor()
+        for table_version, table in schema:
+            if table_version <= version:
+                continue
+            for stmt in connector.to_sql(table):
+                cursor.execute(stmt)
+        for index_version, name, columns in indexes:
+            if index_version <= version:
+                continue
+            table = Table(name)[tuple(Column(c) for c in columns)
+                                + (Index(list(columns)),)]
+            for stmt in connector.to_sql(table):
+                if not stmt.startswith('CREATE TABLE'):
+                    cursor.execute(stmt)
+        if version:
+            cursor.execute("UPDATE system SET value=%s "
+                           "WHERE name='svnadmin_version'", (schema_version,))
+        else:
+            cursor.execute("INSERT INTO system (name, value) "
+                           "VALUES ('svnadmin_version', %s)", (schema_version,))
+        self.log.info('Upgraded SVNAdmin tables from version %d to %d',
+                      version, schema_version)
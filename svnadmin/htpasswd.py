@@ -0,0 +1,162 @@
+# SVNAdmin plugin
+
+import os
+import os.path
+import random
+from base64 import b64encode
+from collections import OrderedDict
+from hashlib import md5, sha1
+
+from svnadmin.util import atomic_write
+
+
+HASH_METHODS = ('md5', 'sha1', 'bcrypt')
+
+_ITOA64 = './0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+_random = random.SystemRandom()
+
+
+def _to64(v, n):
+    s = ''
+    while n > 0:
+        s += _ITOA64[v & 0x3f]
+        v >>= 6
+        n -= 1
+    return s
+
+
+def _key(username):
+    if isinstance(username, unicode):
+        return username.encode('utf-8')
+    return username
+
+
+def _salt(length):
+    return ''.join(_random.choice(_ITOA64) for i in xrange(length))
+
+
+def apr1_md5(password, salt):
+    '''Apache specific MD5 based crypt (`htpasswd -m`).'''
+    magic = '$apr1$'
+    salt = salt[:8]
+    ctx = password + magic + salt
+    final = md5(password + salt + password).digest()
+    for pl in xrange(len(password), 0, -16):
+        ctx += final[:min(16, pl)]
+    i = len(password)
+    while i:
+        if i & 1:
+            ctx += '\0'
+        else:
+            ctx += password[0]
+        i >>= 1
+    final = md5(ctx).digest()
+    for i in xrange(1000):
+        ctx1 = password if i & 1 else final
+        if i % 3:
+            ctx1 += salt
+        if i % 7:
+            ctx1 += password
+        ctx1 += final if i & 1 else password
+        final = md5(ctx1).digest()
+    f = [ord(c) for c in final]
+    hash = ''.join(_to64((f[a] << 16) | (f[b] << 8) | f[c], 4)
+                   for a, b, c in ((0, 6, 12), (1, 7, 13), (2, 8, 14),
+                                   (3, 9, 15), (4, 10, 5)))
+    hash += _to64(f[11], 2)
+    return magic + salt + '$' + hash
+
+
+def hash_password(password, method='md5'):
+    '''Return htpasswd compatible hash of `password`.
+
+    Supported methods are `md5` (APR1-MD5, `htpasswd -m`), `sha1`
+    (`htpasswd -s`) and `bcrypt` (`htpasswd -B`, requires `bcrypt` module).
+    '''
+    if isinstance(password, unicode):
+        password = password.encode('utf-8')
+    if method == 'md5':
+        return apr1_md5(password, _salt(8))
+    elif method == 'sha1':
+        return '{SHA}' + b64encode(sha1(password).digest())
+    elif method == 'bcrypt':
+        try:
+            import bcrypt
+        except ImportError:
+            raise ValueError('bcrypt module is required for bcrypt hashes')
+        hash = bcrypt.hashpw(password, bcrypt.gensalt())
+        # Apache accepts only $2y$ prefix
+        return '$2y$' + hash[4:]
+    raise ValueError('Unsupported hash method: %s' % method)
+
+
+class HtpasswdFile(object):
+    '''In-memory index of htpasswd file entries keyed by username.
+
+    Entry order is preserved on save. The file is parsed again by
+    `load()` only when its modification time or size has changed.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = OrderedDict()
+        self._stamp = None
+
+    def __contains__(self, username):
+        return _key(username) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _get_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def load(self, force=False):
+        '''(Re)read file if it was changed since the last load.
+        Return True if file was read.'''
+        stamp = self._get_stamp()
+        if not force and stamp is not None and stamp == self._stamp:
+            return False
+        entries = OrderedDict()
+        if stamp is not None:
+            fp = open(self.path, 'rb')
+            try:
+                for line in fp:
+                    line = line.rstrip('\r\n')
+                    if not line or line.startswith('#') or ':' not in line:
+                        continue
+                    username, hash = line.split(':', 1)
+                    entries[username] = hash
+            finally:
+                fp.close()
+        self.entries = entries
+        self._stamp = stamp
+        return True
+
+    def save(self):
+        '''Write all entries back to the file atomically.
+        Return number of written bytes.'''
+        data = ''.join('%s:%s\n' % item for item in self.entries.iteritems())
+        atomic_write(self.path, data)
+        self._stamp = self._get_stamp()
+        return len(data)
+
+    def get_hash(self, username):
+        return self.entries.get(_key(username))
+
+    def set_hash(self, username, hash):
+        username = _key(username)
+        if not username or ':' in username or '\n' in username:
+            raise ValueError('Invalid username: %r' % username)
+        self.entries[username] = hash
+
+    def set_password(self, username, password, method='md5'):
+        self.set_hash(username, hash_password(password, method))
+
+    def delete(self, username):
+        '''Delete user. Return False if user doesn't exist.'''
+        return self.entries.pop(_key(username), None) is not None
@@ -0,0 +1,182 @@
+# SVNAdmin plugin
+
+from collections import OrderedDict
+from datetime import datetime
+
+from trac.config import ChoiceOption, IntOption
+from trac.core import *
+from trac.util.datefmt import to_utimestamp, utc
+from trac.util.text import exception_to_unicode
+from trac.web.api import IRequestFilter
+
+from svnadmin.api import SvnAdmin
+from svnadmin.htpasswd import hash_password
+from svnadmin.util import BackgroundThread, FileLock
+
+
+# maximum delay in seconds between retries after failed replication
+MAX_BACKOFF = 600
+
+
+class SvnReplicationQueue(Component):
+    """Component queueing SVN user changes in the database and applying
+    them to SVN password file in the background.
+
+    Only password hashes are stored in the queue. Queued changes of the
+    same user are coalesced into the last one and every batch is written
+    to the password file at once.
+    """
+
+    implements(IRequestFilter)
+
+    replication_mode = ChoiceOption('svnadmin', 'replication_mode',
+         ['sync', 'async'],
+         'How AccountManager user changes are replicated: `sync` updates '
+         'SVN password file immediately, `async` queues changes to apply '
+         'them in the background (requires builtin htpasswd backend).')
+    replication_interval = IntOption('svnadmin', 'replication_interval', 5,
+         'Interval in seconds between runs of queued SVN user changes '
+         'replication.')
+    replication_batch_size = IntOption('svnadmin', 'replication_batch_size',
+         1000, 'Maximum number of queued SVN user changes applied at once.')
+
+    def __init__(self):
+        self.svnadmin = SvnAdmin(self.env)
+        self._thread = BackgroundThread('svnadmin-replication', self._run,
+                                        self.log)
+
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        if self.is_async():
+            self._thread.start()
+        return handler
+
+    def post_process_request(self, req, template, data, content_type):
+        return template, data, content_type
+
+    # Public API
+
+    def is_async(self):
+        return self.replication_mode == 'async' and \
+               self.svnadmin.htpasswd_backend == 'builtin'
+
+    def enqueue_password(self, username, password):
+        """Queue change of SVN user password / new SVN user."""
+        hash = hash_password(password, self.svnadmin.hash_method)
+        self._enqueue(username, 'set', hash)
+
+    def enqueue_delete(self, username):
+        """Queue SVN user deletion."""
+        self._enqueue(username, 'delete', None)
+
+    def get_status(self):
+        """Return tuple (number of queued changes, age of the oldest
+        queued change in seconds)."""
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT COUNT(*), MIN(time) "
+                       "FROM svnadmin_replication_queue")
+        depth, oldest = cursor.fetchone()
+        lag = 0
+        if oldest:
+            now = to_utimestamp(datetime.now(utc))
+            lag = max(0, (now - oldest) / 1000000)
+        return depth, lag
+
+    def process_queue(self):
+        """Apply queued changes to SVN password file.
+        Return number of processed queue entries. Raise `IOError` if
+        the password file can't be written, the changes stay queued."""
+        if not self.svnadmin.passwd_path:
+            return 0
+        total = 0
+        # only one process at a time may drain the queue to keep order
+        with FileLock(self.svnadmin.passwd_path + '.queue'):
+            while True:
+                count = self._process_batch()
+                total += count
+                if count < self.replication_batch_size:
+                    break
+        return total
+
+    # Internal methods
+
+    def _enqueue(self, username, action, hash):
+        now = to_utimestamp(datetime.now(utc))
+        @self.env.with_transaction()
+        def do_enqueue(db):
+            cursor = db.cursor()
+            cursor.execute("INSERT INTO svnadmin_replication_queue "
+                           "(username, action, hash, time) "
+                           "VALUES (%s, %s, %s, %s)",
+                           (username, action, hash, now))
+        if not self._thread.start():
+            self._thread.wakeup()
+
+    def _run(self):
+        failures = 0
+        while not self._thread.stopping:
+            try:
+                self.process_queue()
+                failures = 0
+            except IOError, e:
+                failures += 1
+                self.log.error('SVN users replication failed, changes are '
+                               'kept in queue: %s', exception_to_unicode(e))
+            except Exception, e:
+                failures += 1
+                self.log.error('SVN users replication failed: %s',
+                               exception_to_unicode(e, traceback=True))
+            interval = max(1, self.replication_interval)
+            if failures:
+                # back off, new changes don't wake the thread up
+                self._thread.wait(min(interval * 2 ** min(failures, 10),
+                                      MAX_BACKOFF), wakeup=False)
+            else:
+                self._thread.wait(interval)
+
+    def _process_batch(self):
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT id, username, action, hash "
+                       "FROM svnadmin_replication_queue ORDER BY id "
+                       "LIMIT %s", (self.replication_batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            return 0
+        err = self.svnadmin.check_passwd_file()
+        if err:
+            raise IOError(err)
+        depth, lag = self.get_status()
+
+        # coalesce changes of the same user into the last one
+        last = OrderedDict()
+        for id, username, action, hash in rows:
+            last.pop(username, None)
+            last[username] = (action, hash)
+        hashes = [(u, h) for u, (a, h) in last.iteritems() if a == 'set']
+        deleted = [u for u, (a, h) in last.iteritems() if a == 'delete']
+
+        results, err = self.svnadmin._update_users(hashes=hashes,
+                                                   deleted=deleted)
+        if err:
+            # nothing has been written, keep the batch for the next run
+            raise IOError(err)
+        for username, err in results.iteritems():
+            if err:
+                self.log.warning('SVN users replication: %s, %s',
+                                 username, err)
+
+        # rows of transactions committed after the SELECT may have lower
+        # ids, delete only the rows which have been applied
+        @self.env.with_transaction()
+        def do_delete(db):
+            cursor = db.cursor()
+            cursor.executemany("DELETE FROM svnadmin_replication_queue "
+                               "WHERE id=%s", [(row[0],) for row in rows])
+
+        self.log.info('SVN users replication: applied %d changes of %d users '
+                      '(queue depth %d, lag %ds)',
+                      len(rows), len(last), depth, lag)
+        return len(rows)
@@ -0,0 +1,246 @@
+# SVNAdmin plugin
+
+import os
+import os.path
+import stat
+import threading
+import time
+from datetime import datetime
+
+from trac.admin import IAdminCommandProvider
+from trac.config import IntOption
+from trac.core import *
+from trac.util.datefmt import from_utimestamp, to_utimestamp, utc
+from trac.util.text import exception_to_unicode, printout
+from trac.web.api import IRequestFilter
+
+from svnadmin.api import SvnRepositoryProvider
+from svnadmin.util import BackgroundThread, run_exclusive
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+# directories with revision shards, every shard is scanned only when
+# its mtime has changed
+SHARDED_DIRS = (os.path.join('db', 'revs'), os.path.join('db', 'revprops'))
+
+
+def _iterdir(path):
+    """Yield (name, path, stat result) of directory entries, using
+    `scandir` when available."""
+    if scandir is not None:
+        for entry in scandir(path):
+            yield entry.name, entry.path, entry.stat(follow_symlinks=False)
+    else:
+        for name in os.listdir(path):
+            entry_path = os.path.join(path, name)
+            yield name, entry_path, os.lstat(entry_path)
+
+
+def _tree_size(path, skip=()):
+    """Return total size of files below `path` except directories in
+    `skip`."""
+    size = 0
+    for name, entry_path, st in _iterdir(path):
+        if stat.S_ISDIR(st.st_mode):
+            if entry_path not in skip:
+                size += _tree_size(entry_path, skip)
+        else:
+            size += st.st_size
+    return size
+
+
+class SvnRepositoryStatistics(Component):
+    """Component collecting disk usage and activity statistics of
+    repositories.
+
+    Scanning is incremental: revision shard directories (`db/revs/N`,
+    `db/revprops/N`) are walked again only when their mtime has changed
+    since the previous scan. Results are stored in the
+    `svnadmin_repository_stats` table.
+    """
+
+    implements(IAdminCommandProvider, IRequestFilter)
+
+    stats_interval = IntOption('svnadmin', 'stats_interval', 3600,
+         'Interval in seconds between background repository statistics '
+         'scans. Set to 0 to disable background scanning.')
+
+    def __init__(self):
+        self._thread = BackgroundThread('svnadmin-stats', self._run, self.log)
+        self._run_lock = threading.Lock()
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('svnadmin stats scan', '',
+               'Update disk usage and activity statistics of repositories',
+               None, self._do_scan)
+
+    def _do_scan(self):
+        start = time.time()
+        num = self.scan_all()
+        printout('%d repositories scanned in %.2fs'
+                 % (num, time.time() - start))
+
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        if self.stats_interval > 0:
+            self._thread.start()
+        return handler
+
+    def post_process_request(self, req, template, data, content_type):
+        return template, data, content_type
+
+    # Public API
+
+    def get_stats(self):
+        """Return dict of stored statistics keyed by repository name."""
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT repos, size, revisions, last_commit, "
+                       "prev_size, scan_time FROM svnadmin_repository_stats")
+        stats = {}
+        for repos, size, revisions, last_commit, prev_size, ts in cursor:
+            stats[repos] = {
+                'size': size,
+                'revisions': revisions,
+                'last_commit': last_commit and from_utimestamp(last_commit),
+                'growth': size - prev_size if prev_size is not None else None,
+                'scan_time': ts and from_utimestamp(ts),
+            }
+        return stats
+
+    def scan_all(self, interval=0):
+        """Scan all repositories and store their statistics.
+        Return number of scanned repositories.
+
+        Scans are serialized between threads and processes; nothing is
+        scanned if another scan is in progress or, with `interval`, the
+        last scan finished less than `interval` seconds ago."""
+        provider = self.env[SvnRepositoryProvider]
+        if not provider.parentpath or \
+                not os.path.isdir(provider.parentpath):
+            return 0
+        if not self._run_lock.acquire(False):
+            return 0  # already running
+        try:
+            lockpath = os.path.join(provider.get_work_dir(), 'stats')
+            return run_exclusive(lockpath, self._scan_all, interval) or 0
+        finally:
+            self._run_lock.release()
+
+    # Internal methods
+
+    def _run(self):
+        while self.stats_interval > 0:
+            try:
+                self.scan_all(self.stats_interval)
+            except Exception, e:
+                self.log.error('Repository statistics scan failed: %s',
+                               exception_to_unicode(e, traceback=True))
+            if not self._thread.wait(self.stats_interval):
+                break
+
+    def _scan_all(self):
+        provider = self.env[SvnRepositoryProvider]
+        start = time.time()
+        names = provider.get_repository_names()
+
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT repos, size FROM svnadmin_repository_stats")
+        sizes = dict(cursor)
+        cursor.execute("SELECT repos, shard, mtime, size "
+                       "FROM svnadmin_repository_shards")
+        shards = {}
+        for repos, shard, mtime, size in cursor:
+            shards.setdefault(repos, {})[shard] = (mtime, size)
+
+        results = []
+        rescanned = 0
+        for name in names:
+            try:
+                result = self._scan_repository(provider, name,
+                                               shards.get(name, {}))
+            except OSError, e:
+                self.log.warning('Failed to scan repository %s: %s',
+                                 name, exception_to_unicode(e))
+                continue
+            rescanned += result[-1]
+            results.append(result)
+
+        now = to_utimestamp(datetime.now(utc))
+        @self.env.with_transaction()
+        def do_save(db):
+            cursor = db.cursor()
+            for name, size, revisions, last_commit, new_shards, n in results:
+                cursor.execute("DELETE FROM svnadmin_repository_stats "
+                               "WHERE repos=%s", (name,))
+                cursor.execute("INSERT INTO svnadmin_repository_stats "
+                               "(repos, size, revisions, last_commit, "
+                               "prev_size, scan_time) "
+                               "VALUES (%s, %s, %s, %s, %s, %s)",
+                               (name, size, revisions, last_commit,
+                                sizes.get(name), now))
+                if new_shards != shards.get(name):
+                    cursor.execute("DELETE FROM svnadmin_repository_shards "
+                                   "WHERE repos=%s", (name,))
+                    cursor.executemany("INSERT INTO svnadmin_repository_shards "
+                                       "(repos, shard, mtime, size) "
+                                       "VALUES (%s, %s, %s, %s)",
+                                       [(name, shard, mtime, size)
+                                        for shard, (mtime, size)
+                                        in new_shards.iteritems()])
+            for name in set(sizes) - set(names):
+                cursor.execute("DELETE FROM svnadmin_repository_stats "
+                               "WHERE repos=%s", (name,))
+                cursor.execute("DELETE FROM svnadmin_repository_shards "
+                               "WHERE repos=%s", (name,))
+
+        self.log.info('Scanned %d repositories (%d shards walked) in %.2fs',
+                      len(results), rescanned, time.time() - start)
+        return len(results)
+
+    def _scan_repository(self, provider, name, shards):
+        """Return tuple (name, size, revisions, last commit, shards,
+        number of walked shards). `shards` is a dict of shard paths and
+        (mtime, size) pairs from the previous scan."""
+        dir = os.path.join(provider.parentpath, name)
+        sharded = [os.path.join(dir, path) for path in SHARDED_DIRS]
+        size = _tree_size(dir, skip=sharded)
+        new_shards = {}
+        walked = 0
+        for path in sharded:
+            if not os.path.isdir(path):
+                continue
+            for entry, entry_path, st in _iterdir(path):
+                if not stat.S_ISDIR(st.st_mode):
+                    size += st.st_size  # unsharded repository
+                    continue
+                shard = os.path.relpath(entry_path, dir)
+                mtime = long(st.st_mtime * 1000000)
+                cached = shards.get(shard)
+                if cached and cached[0] == mtime:
+                    shard_size = cached[1]
+                else:
+                    shard_size = _tree_size(entry_path)
+                    walked += 1
+                new_shards[shard] = (mtime, shard_size)
+                size += shard_size
+
+        rev = provider.get_youngest_rev(dir)
+        try:
+            mtime = os.stat(os.path.join(dir, 'db', 'current')).st_mtime
+            last_commit = to_utimestamp(datetime.fromtimestamp(mtime, utc))
+        except OSError:
+            last_commit = None
+        return (name, size, rev + 1 if rev is not None else None,
+                last_commit, new_shards, walked)
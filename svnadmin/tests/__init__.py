@@ -0,0 +1,16 @@
+# SVNAdmin plugin
+
+import unittest
+
+from svnadmin.tests import authz, htpasswd, util
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(authz.suite())
+    suite.addTest(htpasswd.suite())
+    suite.addTest(util.suite())
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
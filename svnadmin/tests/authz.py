@@ -0,0 +1,247 @@
+# SVNAdmin plugin
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from trac.core import TracError
+from trac.test import EnvironmentStub
+
+from svnadmin.authz import AuthzEvaluator, AuthzFile, AuthzSyntaxError, \
+                           SvnAuthzManager
+from svnadmin.timing import SvnOperationTimer
+from svnadmin.util import ConcurrentUpdateError
+
+
+class AuthzFileTestCase(unittest.TestCase):
+
+    def test_parse(self):
+        authz = AuthzFile('# comment\n'
+                          '[groups]\n'
+                          'staff = alice, bob\n'
+                          '\n'
+                          '[repos:/trunk]\n'
+                          '@staff = rw\n'
+                          '* = r\n')
+        self.assertEqual(['groups', 'repos:/trunk'], authz.sections())
+        self.assertEqual({'staff': ['alice', 'bob']}, authz.groups())
+        self.assertEqual({'repos:/trunk': [('@staff', 'rw'), ('*', 'r')]},
+                         authz.rules())
+
+    def test_continuation_lines(self):
+        authz = AuthzFile('[groups]\n'
+                          'staff = alice,\n'
+                          '  bob,\n'
+                          '\tcarol\n'
+                          'admins = dave\n')
+        self.assertEqual(['alice', 'bob', 'carol'],
+                         authz.groups()['staff'])
+        self.assertEqual(['dave'], authz.groups()['admins'])
+
+    def test_colon_separator(self):
+        authz = AuthzFile('[groups]\n'
+                          'staff: alice, bob\n'
+                          '[/]\n'
+                          '@staff: rw\n'
+                          '$anonymous : r\n')
+        self.assertEqual(['alice', 'bob'], authz.groups()['staff'])
+        self.assertEqual([('@staff', 'rw'), ('$anonymous', 'r')],
+                         authz.items('/'))
+
+    def test_invalid_syntax(self):
+        self.assertRaises(AuthzSyntaxError, AuthzFile, '[/]\ngarbage\n')
+        self.assertRaises(AuthzSyntaxError, AuthzFile, 'alice = rw\n')
+        self.assertRaises(AuthzSyntaxError, AuthzFile, '  alice = rw\n')
+
+    def test_round_trip(self):
+        text = ('# comment\n'
+                '[groups]\n'
+                'staff = alice,\n'
+                '  bob\n'
+                '\n'
+                '[/]\n'
+                '* : r\n')
+        self.assertEqual(text, str(AuthzFile(text)))
+
+    def test_edit_continued_entry(self):
+        authz = AuthzFile('[groups]\n'
+                          'staff = alice,\n'
+                          '  bob\n'
+                          'admins = dave\n')
+        self.assertTrue(authz.add_group_member('staff', 'carol'))
+        self.assertEqual('[groups]\n'
+                         'staff = alice, bob, carol\n'
+                         'admins = dave\n', str(authz))
+        authz = AuthzFile('[groups]\n'
+                          'staff = alice,\n'
+                          '  bob\n'
+                          'admins = dave\n')
+        self.assertTrue(authz.remove('groups', 'staff'))
+        self.assertEqual('[groups]\nadmins = dave\n', str(authz))
+
+    def test_set_appends_after_last_entry(self):
+        authz = AuthzFile('[/]\n'
+                          'alice = rw\n'
+                          '  \n'
+                          '[repos:/]\n'
+                          'bob = r\n')
+        authz.set('/', 'carol', 'r')
+        authz.set('/new', 'dave', 'rw')
+        self.assertEqual('[/]\n'
+                         'alice = rw\n'
+                         'carol = r\n'
+                         '  \n'
+                         '[repos:/]\n'
+                         'bob = r\n'
+                         '\n'
+                         '[/new]\n'
+                         'dave = rw\n', str(authz))
+
+
+class AuthzEvaluatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.evaluator = AuthzEvaluator(AuthzFile("""\
+[groups]
+staff = alice, @admins
+admins = bob
+loop = @loop, eve
+
+[aliases]
+carl = carl.long
+
+[/]
+* = r
+
+[/secret]
+* =
+@admins = rw
+
+[/private]
+~@staff = r
+@staff = rw
+
+[repos:/]
+$authenticated = rw
+
+[repos:/secret]
+alice = r
+
+[repos:/aliased]
+&carl = rw
+"""))
+
+    def _perm(self, user, repos, path):
+        return self.evaluator.get_permission(user, repos, path)
+
+    def test_groups(self):
+        self.assertEqual(set(['staff', 'admins']),
+                         self.evaluator.get_groups('bob'))
+        self.assertEqual(set(['alice', 'bob']),
+                         self.evaluator.get_group_members('staff'))
+        self.assertEqual(set(['eve']),
+                         self.evaluator.get_group_members('loop'))
+
+    def test_deepest_path_wins(self):
+        self.assertEqual('r', self._perm('carol', 'other', '/'))
+        self.assertEqual('r', self._perm('carol', 'other', '/trunk/file'))
+        self.assertEqual('', self._perm('carol', 'other', '/secret'))
+        self.assertEqual('', self._perm('carol', 'other', '/secret/a/b'))
+        # global section of deeper path wins over repository section
+        self.assertEqual('', self._perm('carol', 'repos', '/secret/file'))
+
+    def test_repository_section_before_global(self):
+        self.assertEqual('rw', self._perm('carol', 'repos', '/'))
+        self.assertEqual('r', self._perm('alice', 'repos', '/secret'))
+        # no matching rule in repository section, global one applies
+        self.assertEqual('r', self._perm(None, 'repos', '/trunk'))
+
+    def test_matching_rules_of_section_are_combined(self):
+        self.assertEqual('rw', self._perm('bob', 'other', '/secret'))
+
+    def test_negated_group(self):
+        self.assertEqual('r', self._perm('carol', 'other', '/private'))
+        self.assertEqual('r', self._perm(None, 'other', '/private'))
+        self.assertEqual('rw', self._perm('alice', 'other', '/private'))
+        self.assertEqual('rw', self._perm('bob', 'other', '/private/x'))
+
+    def test_alias(self):
+        self.assertEqual('rw', self._perm('carl.long', 'repos', '/aliased'))
+
+    def test_permissions_matrix(self):
+        self.assertEqual({'alice': {'repos': 'rw', 'other': 'r'},
+                          None: {'repos': 'r', 'other': 'r'}},
+                         self.evaluator.get_permissions_matrix(
+                             ['alice', None], ['repos', 'other']))
+
+
+class SvnAuthzManagerTestCase(unittest.TestCase):
+
+    text = ('[groups]\n'
+            'staff = alice,\n'
+            '  bob\n'
+            '\n'
+            '# rules\n'
+            '[/]\n'
+            '@staff: rw\n')
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', 'svnadmin.*'])
+        self.dir = tempfile.mkdtemp()
+        self.env.config.set('trac', 'authz_file',
+                            os.path.join(self.dir, 'authz'))
+        self.manager = SvnAuthzManager(self.env)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        self.env.reset_db()
+
+    def test_round_trip(self):
+        self.manager.save_text(self.text)
+        self.assertEqual(self.text, self.manager.get_text()[0])
+        self.assertEqual('rw', self.manager.get_permission('bob', 'r', '/'))
+        self.manager.add_rule('/', 'carol', 'r')
+        self.assertEqual(self.text + 'carol = r\n',
+                         self.manager.get_text()[0])
+        self.assertEqual('r', self.manager.get_permission('carol', 'r', '/'))
+
+    def test_stale_save(self):
+        self.manager.save_text(self.text)
+        text, version = self.manager.get_text()
+        self.manager.add_group_member('staff', 'carol')
+        self.assertRaises(ConcurrentUpdateError, self.manager.save_text,
+                          text, version)
+        self.assertEqual(['alice', 'bob', 'carol'],
+                         self.manager.get_authz().groups()['staff'])
+
+    def test_invalid_text(self):
+        self.assertRaises(TracError, self.manager.save_text, 'garbage\n')
+        self.assertFalse(os.path.exists(self.env.config.get('trac',
+                                                            'authz_file')))
+
+    def test_write_timing(self):
+        timer = SvnOperationTimer(self.env)
+        timer.reset()
+        self.manager.save_text(self.text)
+        self.manager.remove_rule('/', 'nobody')
+        stats = timer.get_stats()['write authz']
+        self.assertEqual(1, stats['count'])
+        self.assertEqual(len(self.text), stats['size'])
+
+    def test_timer_disabled(self):
+        env = EnvironmentStub(enable=['trac.*', 'svnadmin.authz.*'])
+        env.config.set('trac', 'authz_file', os.path.join(self.dir, 'authz'))
+        SvnAuthzManager(env).save_text(self.text)
+        self.assertEqual(self.text, self.manager.get_text()[0])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(AuthzFileTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(AuthzEvaluatorTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(SvnAuthzManagerTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
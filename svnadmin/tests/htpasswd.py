@@ -0,0 +1,91 @@
+# SVNAdmin plugin
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from svnadmin.htpasswd import HtpasswdFile, apr1_md5, hash_password
+
+
+class HashTestCase(unittest.TestCase):
+
+    def test_apr1_md5(self):
+        # reference values from `openssl passwd -apr1 -salt ...`
+        self.assertEqual('$apr1$saltsalt$LrttParrLPdxvgutaSXWJ0',
+                         apr1_md5('secret', 'saltsalt'))
+        self.assertEqual('$apr1$ab$WUUIm3w3PcOUCEGyrqPHZ/',
+                         apr1_md5('a much longer password over sixteen '
+                                  'chars', 'ab'))
+
+    def test_hash_password_md5(self):
+        hash = hash_password('secret', 'md5')
+        self.assertTrue(hash.startswith('$apr1$'))
+        salt = hash.split('$')[2]
+        self.assertEqual(8, len(salt))
+        self.assertEqual(hash, apr1_md5('secret', salt))
+        self.assertNotEqual(hash, hash_password('secret', 'md5'))
+
+    def test_hash_password_sha1(self):
+        self.assertEqual('{SHA}5en6G6MezRroT3XKqkdPOmY/BfQ=',
+                         hash_password('secret', 'sha1'))
+        # unicode passwords are hashed as utf-8
+        self.assertEqual('{SHA}ta81cOE4wM/twp7YSmra6UHf0uo=',
+                         hash_password(u'p\xe4ss', 'sha1'))
+
+    def test_unsupported_method(self):
+        self.assertRaises(ValueError, hash_password, 'secret', 'crypt')
+
+
+class HtpasswdFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'passwd')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _read(self):
+        fp = open(self.path, 'rb')
+        try:
+            return fp.read()
+        finally:
+            fp.close()
+
+    def test_missing_file(self):
+        passwd = HtpasswdFile(self.path)
+        self.assertTrue(passwd.load())
+        self.assertEqual(0, len(passwd))
+
+    def test_update_keeps_order(self):
+        fp = open(self.path, 'wb')
+        fp.write('# comment\nalice:{SHA}a\nbob:{SHA}b\ncarol:{SHA}c\n')
+        fp.close()
+        passwd = HtpasswdFile(self.path)
+        passwd.load()
+        self.assertTrue('bob' in passwd)
+        passwd.set_hash('alice', '{SHA}x')
+        passwd.set_password(u'dave', 'secret', 'sha1')
+        self.assertTrue(passwd.delete('bob'))
+        self.assertFalse(passwd.delete('bob'))
+        passwd.save()
+        self.assertEqual('alice:{SHA}x\ncarol:{SHA}c\n'
+                         'dave:{SHA}5en6G6MezRroT3XKqkdPOmY/BfQ=\n',
+                         self._read())
+        self.assertFalse(passwd.load())  # not changed since save
+
+    def test_invalid_username(self):
+        passwd = HtpasswdFile(self.path)
+        self.assertRaises(ValueError, passwd.set_hash, 'a:b', '{SHA}x')
+        self.assertRaises(ValueError, passwd.set_hash, '', '{SHA}x')
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(HashTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(HtpasswdFileTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
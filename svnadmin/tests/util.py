@@ -0,0 +1,129 @@
+# SVNAdmin plugin
+
+import os
+import os.path
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+from svnadmin.util import BackgroundThread, ConcurrentUpdateError, \
+                          atomic_write, read_file, update_file
+
+
+class UpdateFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'authz')
+        atomic_write(self.path, 'old\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_atomic_write_keeps_mode(self):
+        os.chmod(self.path, 0640)
+        atomic_write(self.path, 'new\n')
+        self.assertEqual(0640, stat.S_IMODE(os.stat(self.path).st_mode))
+        self.assertEqual('new\n', read_file(self.path)[0])
+        self.assertEqual(['authz'], os.listdir(self.dir))
+
+    def test_update_through_symlink(self):
+        link = os.path.join(self.dir, 'link')
+        os.symlink(self.path, link)
+        update_file(link, lambda data: 'new\n')
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual('new\n', read_file(self.path)[0])
+
+    def test_read_missing_file(self):
+        data, version = read_file(os.path.join(self.dir, 'missing'))
+        self.assertEqual('', data)
+        self.assertEqual(read_file(self.path)[1],
+                         update_file(self.path, lambda data: None))
+
+    def test_update(self):
+        data, version = read_file(self.path)
+        new_version = update_file(self.path, lambda data: data + 'new\n',
+                                  version)
+        self.assertEqual(('old\nnew\n', new_version), read_file(self.path))
+        self.assertNotEqual(version, new_version)
+
+    def test_unchanged(self):
+        mtime = os.stat(self.path).st_mtime
+        version = update_file(self.path, lambda data: None)
+        self.assertEqual(read_file(self.path)[1], version)
+        self.assertEqual(mtime, os.stat(self.path).st_mtime)
+
+    def test_stale_version(self):
+        data, version = read_file(self.path)
+        update_file(self.path, lambda data: 'concurrent\n')
+        called = []
+        def fn(data):
+            called.append(data)
+            return 'stale\n'
+        self.assertRaises(ConcurrentUpdateError, update_file, self.path, fn,
+                          version)
+        self.assertEqual([], called)
+        self.assertEqual('concurrent\n', read_file(self.path)[0])
+
+
+class BackgroundThreadTestCase(unittest.TestCase):
+
+    def test_start_once(self):
+        runs = []
+        release = threading.Event()
+        def target():
+            runs.append(1)
+            release.wait(5)
+        thread = BackgroundThread('test', target)
+        self.assertTrue(thread.start())
+        self.assertFalse(thread.start())
+        self.assertTrue(thread.running)
+        release.set()
+        for i in xrange(100):
+            if not thread.running:
+                break
+            time.sleep(0.01)
+        self.assertFalse(thread.running)
+        self.assertEqual([1], runs)
+        # can be started again after target returned
+        self.assertTrue(thread.start())
+        thread.stop(5)
+        self.assertEqual([1, 1], runs)
+
+    def test_wakeup_and_stop(self):
+        wakeups = []
+        def target():
+            while thread.wait(60):
+                wakeups.append(1)
+        thread = BackgroundThread('test', target)
+        thread.start()
+        thread.wakeup()
+        for i in xrange(100):
+            if wakeups:
+                break
+            time.sleep(0.01)
+        self.assertEqual([1], wakeups)
+        start = time.time()
+        thread.stop(5)
+        self.assertTrue(time.time() - start < 5)
+        self.assertFalse(thread.running)
+
+    def test_wait_without_wakeup(self):
+        thread = BackgroundThread('test', None)
+        thread.wakeup()
+        start = time.time()
+        self.assertTrue(thread.wait(0.2, wakeup=False))
+        self.assertTrue(time.time() - start >= 0.2)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(UpdateFileTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(BackgroundThreadTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,136 @@
+# SVNAdmin plugin
+
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from trac.config import FloatOption, IntOption
+from trac.core import *
+
+
+# upper bounds (in seconds) of histogram buckets, values above the last
+# bound fall into an extra bucket
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+class _Operation(object):
+    '''Counters and rolling window of samples of one operation type.'''
+
+    __slots__ = ('samples', 'count', 'errors')
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)  # (duration, exit code, size)
+        self.count = 0
+        self.errors = 0
+
+    def add(self, duration, exit_code, size):
+        self.samples.append((duration, exit_code, size))
+        self.count += 1
+        if exit_code:
+            self.errors += 1
+
+    def summary(self):
+        durations = sorted(duration for duration, code, size
+                           in self.samples)
+        histogram = [0] * (len(BUCKETS) + 1)
+        for duration in durations:
+            histogram[bisect_left(BUCKETS, duration)] += 1
+        def percentile(p):
+            if not durations:
+                return None
+            return durations[min(len(durations) - 1,
+                                 int(len(durations) * p))]
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'window': len(durations),
+            'mean': sum(durations) / len(durations) if durations else None,
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'max': durations[-1] if durations else None,
+            'size': sum(size or 0 for duration, code, size in self.samples),
+            'last_exit_code': self.samples[-1][1] if self.samples else None,
+            'histogram': histogram,
+        }
+
+
+class _Timing(object):
+    '''Context manager measuring one operation. Exit code and payload
+    size can be set on the object inside the `with` block.'''
+
+    def __init__(self, timer, operation, size):
+        self.timer = timer
+        self.operation = operation
+        self.size = size
+        self.exit_code = None
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.exit_code is None:
+            self.exit_code = -1 if exc_type is not None else 0
+        self.timer.record(self.operation, time.time() - self._start,
+                          self.exit_code, self.size)
+
+
+class SvnOperationTimer(Component):
+    """Component collecting durations of subprocess calls and file
+    writes.
+
+    Statistics are kept in memory per operation type (e.g.
+    `svnadmin create`, `write passwd`) over a rolling window of the last
+    `timing_window` operations. Operations slower than
+    `slow_operation_threshold` are logged.
+    """
+
+    slow_operation_threshold = FloatOption('svnadmin',
+         'slow_operation_threshold', 5.0,
+         'Subprocess calls and file writes taking longer than this number '
+         'of seconds are logged as warnings. Set to 0 to disable.')
+    timing_window = IntOption('svnadmin', 'timing_window', 1000,
+         'Number of the most recent operations of each type kept for '
+         'timing statistics.')
+
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    # Public API
+
+    def timed(self, operation, size=None):
+        """Return context manager recording duration of `operation`::
+
+            with timer.timed('svnadmin create') as t:
+                ...
+                t.exit_code = process.returncode
+        """
+        return _Timing(self, operation, size)
+
+    def record(self, operation, duration, exit_code=0, size=None):
+        """Record operation which took `duration` seconds."""
+        with self._lock:
+            op = self._operations.get(operation)
+            if op is None:
+                op = self._operations[operation] = \
+                        _Operation(max(1, self.timing_window))
+            op.add(duration, exit_code, size)
+        threshold = self.slow_operation_threshold
+        if threshold > 0 and duration >= threshold:
+            self.log.warning('Slow operation %s: %.2fs (exit code %s, '
+                             'payload %s bytes)', operation, duration,
+                             exit_code, size if size is not None else '?')
+
+    def get_stats(self):
+        """Return dict of statistics keyed by operation type."""
+        with self._lock:
+            return dict((name, op.summary())
+                        for name, op in self._operations.iteritems())
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
@@ -0,0 +1,306 @@
+# SVNAdmin plugin
+
+import atexit
+import errno
+import os
+import os.path
+import tempfile
+import threading
+import time
+import weakref
+from hashlib import md5
+
+from trac.util.text import exception_to_unicode
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no advisory locking on this platform
+
+
+class FileLock(object):
+    '''Exclusive advisory lock serializing updates of file `path`
+    between processes.
+
+    The lock is taken on a separate `<path>.lock` file, so it stays valid
+    while the locked file itself is replaced by rename. With `shared`
+    the lock can be held by many readers at once and excludes only
+    exclusive holders.
+    '''
+
+    def __init__(self, path, shared=False):
+        self.lockpath = path + '.lock'
+        self.shared = shared
+        self._fp = None
+
+    def acquire(self, blocking=True):
+        '''Take the lock. With `blocking` False return False instead of
+        waiting when the lock is held by another thread or process.'''
+        fp = open(self.lockpath, 'a')
+        if fcntl is not None:
+            flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(fp.fileno(), flags)
+            except IOError, e:
+                fp.close()
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+                raise
+        self._fp = fp
+        return True
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._fp.close()
+            self._fp = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+
+# running `BackgroundThread`s, stopped when the interpreter exits
+_threads = weakref.WeakSet()
+
+# seconds to wait for background threads to finish at exit
+SHUTDOWN_TIMEOUT = 5
+
+
+class BackgroundThread(object):
+    '''Daemon thread calling `target()` in the background.
+
+    `start()` starts the thread unless it is already running, so it can
+    be called on every request. When `target` returns, the thread can be
+    started again. `target` sleeps by `wait()`, which returns False when
+    the thread has been asked to stop by `stop()` or because the
+    interpreter exits.
+    '''
+
+    def __init__(self, name, target, log=None):
+        self.name = name
+        self.target = target
+        self.log = log
+        self._thread = None
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    @property
+    def stopping(self):
+        return self._stopping
+
+    def start(self):
+        '''Start the thread. Return False if it is already running.'''
+        if self._thread is not None:
+            return False
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._stopping = False
+            self._event.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+            _threads.add(self)
+        return True
+
+    def wait(self, timeout, wakeup=True):
+        '''Sleep `timeout` seconds. With `wakeup` the sleep ends early
+        when `wakeup()` is called. Return False if the thread should
+        stop.'''
+        deadline = time.time() + timeout
+        while not self._stopping:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            self._event.wait(remaining)
+            if self._event.is_set():
+                self._event.clear()
+                if wakeup:
+                    break
+        return not self._stopping
+
+    def wakeup(self):
+        self._event.set()
+
+    def stop(self, timeout=None):
+        '''Ask the thread to stop and wait up to `timeout` seconds for
+        it to finish.'''
+        thread = self._thread
+        self._stopping = True
+        self._event.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _run(self):
+        try:
+            self.target()
+        except Exception, e:
+            if self.log is not None:
+                self.log.error('Background thread %s failed: %s', self.name,
+                               exception_to_unicode(e, traceback=True))
+        finally:
+            with self._lock:
+                self._thread = None
+                _threads.discard(self)
+
+
+@atexit.register
+def _stop_threads():
+    threads = list(_threads)
+    for thread in threads:
+        thread.stop(0)
+    deadline = time.time() + SHUTDOWN_TIMEOUT
+    for thread in threads:
+        thread.stop(max(0, deadline - time.time()))
+
+
+def run_exclusive(path, fn, interval=0):
+    '''Call `fn()` under `FileLock` of `path` unless another thread or
+    process holds the lock or, with `interval`, the last run finished
+    less than `interval` seconds ago. Completion time is kept as mtime
+    of `<path>.last` file.
+
+    Return value returned by `fn` or None when it wasn't called.
+    '''
+    lock = FileLock(path)
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        stampfile = path + '.last'
+        if interval > 0:
+            try:
+                if time.time() - os.stat(stampfile).st_mtime < interval:
+                    return None
+            except OSError:
+                pass  # never finished
+        result = fn()
+        open(stampfile, 'w').close()
+        return result
+    finally:
+        lock.release()
+
+
+def atomic_write(path, data):
+    '''Replace contents of file `path` with `data` atomically.
+
+    Data is written to a temporary file in the same directory which is
+    then renamed over `path`, so readers see either old or new contents
+    but never a partially written file. Permissions and group of the
+    existing file are preserved (the group only if the process is
+    allowed to set it). If `path` is a symbolic link, the file it points
+    to is replaced and the link is kept.
+    '''
+    path = os.path.realpath(path)
+    dir, name = os.path.split(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    mode = st.st_mode & 07777 if st is not None else None
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % name, dir=dir)
+    try:
+        fp = os.fdopen(fd, 'wb')
+        try:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        finally:
+            fp.close()
+        if mode is None:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0666 & ~umask
+        if st is not None:
+            try:
+                # e.g. web server reading the file by group permission
+                os.chown(tmp, -1, st.st_gid)
+            except OSError:
+                pass
+        os.chmod(tmp, mode)
+        os.rename(tmp, path)
+    except:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class ConcurrentUpdateError(Exception):
+    '''File was changed since its version token was obtained.'''
+
+    def __init__(self, path):
+        Exception.__init__(self, 'File %s has been changed concurrently'
+                                 % path)
+        self.path = path
+
+
+def file_version(data):
+    '''Return version token of file contents `data`.'''
+    return md5(data).hexdigest()
+
+
+def read_file(path):
+    '''Return tuple (contents, version token) of file `path`. Missing
+    file is treated as empty.'''
+    try:
+        fp = open(path, 'rb')
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        data = ''
+    else:
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+    return data, file_version(data)
+
+
+def get_update_dirs(path):
+    '''Return directories which must be writable to update file `path`
+    by `update_file`: the one of the `.lock` file next to `path` and the
+    one of the file replaced by `atomic_write`.'''
+    dirs = [os.path.dirname(os.path.abspath(path))]
+    target = os.path.dirname(os.path.realpath(path))
+    if target != dirs[0]:
+        dirs.append(target)
+    return dirs
+
+
+def update_file(path, fn, version=None, write=atomic_write):
+    '''Update contents of file `path` in place of other writers.
+
+    The update runs under `FileLock`, so concurrent updates from threads
+    and processes are serialized. `fn(data)` is called with the current
+    contents and returns new contents, or None to leave the file as it
+    is; new contents are written by `write(path, data)`.
+
+    If `version` is given and the file has changed since that token was
+    obtained (see `read_file`), `ConcurrentUpdateError` is raised and
+    `fn` is not called.
+
+    Return version token of the resulting contents.
+    '''
+    with FileLock(path):
+        data, current = read_file(path)
+        if version is not None and version != current:
+            raise ConcurrentUpdateError(path)
+        data = fn(data)
+        if data is None:
+            return current
+        write(path, data)
+        return file_version(data)
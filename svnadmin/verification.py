@@ -0,0 +1,156 @@
+# SVNAdmin plugin
+
+import os.path
+import threading
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+from trac.config import IntOption
+from trac.core import *
+from trac.util.datefmt import from_utimestamp, to_utimestamp, utc
+from trac.util.text import exception_to_unicode
+from trac.web.api import IRequestFilter
+
+from svnadmin.api import SvnRepositoryProvider
+from svnadmin.backend import SvnBackendError
+from svnadmin.util import BackgroundThread, run_exclusive
+
+
+class SvnRepositoryVerifier(Component):
+    """Component verifying repositories in the background.
+
+    Each repository is verified incrementally: only revisions committed
+    after the last successfully verified one are checked. Progress is
+    stored in `svnadmin_verification` table.
+    """
+
+    implements(IRequestFilter)
+
+    verify_interval = IntOption('svnadmin', 'verify_interval', 3600,
+         'Interval in seconds between background verification runs. '
+         'Set to 0 to disable background verification.')
+    verify_workers = IntOption('svnadmin', 'verify_workers', 2,
+         'Maximum number of repositories verified simultaneously.')
+
+    def __init__(self):
+        self._thread = BackgroundThread('svnadmin-verify', self._run,
+                                        self.log)
+        self._run_lock = threading.Lock()
+
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        if self.verify_interval > 0:
+            self._thread.start()
+        return handler
+
+    def post_process_request(self, req, template, data, content_type):
+        return template, data, content_type
+
+    # Public API
+
+    def get_status(self):
+        """Return dict of stored verification results keyed by
+        repository name."""
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT repos, verified_rev, status, message, time "
+                       "FROM svnadmin_verification")
+        status = {}
+        for repos, rev, st, message, ts in cursor:
+            status[repos] = {
+                'verified_rev': rev,
+                'status': st,
+                'message': message,
+                'time': ts and from_utimestamp(ts),
+            }
+        return status
+
+    def verify_all(self, interval=0):
+        """Verify revisions added since the last run in all repositories.
+        Return number of verified repositories.
+
+        Runs are serialized between threads and processes; nothing is
+        verified if another run is in progress or, with `interval`, the
+        last run finished less than `interval` seconds ago."""
+        provider = self.env[SvnRepositoryProvider]
+        if not provider.parentpath or \
+                not os.path.isdir(provider.parentpath):
+            return 0
+        if not self._run_lock.acquire(False):
+            return 0  # already running
+        try:
+            lockpath = os.path.join(provider.get_work_dir(), 'verify')
+            return run_exclusive(lockpath, self._verify_all, interval) or 0
+        finally:
+            self._run_lock.release()
+
+    # Internal methods
+
+    def _run(self):
+        while self.verify_interval > 0:
+            try:
+                self.verify_all(self.verify_interval)
+            except Exception, e:
+                self.log.error('Background verification failed: %s',
+                               exception_to_unicode(e, traceback=True))
+            if not self._thread.wait(self.verify_interval):
+                break
+
+    def _verify_all(self):
+        provider = self.env[SvnRepositoryProvider]
+        status = self.get_status()
+        tasks = []
+        names = set()
+        for name, repo in provider.get_repositories():
+            names.add(name)
+            youngest = provider.get_youngest_rev(repo['dir'])
+            if youngest is None:
+                continue
+            verified = status.get(name, {}).get('verified_rev')
+            if verified is not None and verified >= youngest:
+                continue
+            start = 0 if verified is None else verified + 1
+            tasks.append((name, repo['dir'], start, youngest))
+
+        results = []
+        if tasks:
+            pool = ThreadPool(max(1, self.verify_workers))
+            try:
+                results = pool.map(self._verify_repository, tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+        now = to_utimestamp(datetime.now(utc))
+        @self.env.with_transaction()
+        def do_save(db):
+            cursor = db.cursor()
+            for name, verified, st, message in results:
+                cursor.execute("DELETE FROM svnadmin_verification "
+                               "WHERE repos=%s", (name,))
+                cursor.execute("INSERT INTO svnadmin_verification "
+                               "(repos, verified_rev, status, message, time) "
+                               "VALUES (%s, %s, %s, %s, %s)",
+                               (name, verified, st, message, now))
+            for name in set(status) - names:
+                cursor.execute("DELETE FROM svnadmin_verification "
+                               "WHERE repos=%s", (name,))
+
+        for name, verified, st, message in results:
+            if st != 'ok':
+                self.log.warning('Verification of repository "%s" failed: %s',
+                                 name, message)
+        return len(results)
+
+    def _verify_repository(self, task):
+        '''Verify revisions `start`..`end` of repository.
+        Return tuple (name, verified revision, status, message).'''
+        name, dir, start, end = task
+        provider = self.env[SvnRepositoryProvider]
+        verified = start - 1 if start > 0 else None
+        try:
+            provider.get_backend().verify(dir, start, end)
+        except SvnBackendError, e:
+            return (name, verified, 'failed', e.message)
+        return (name, end, 'ok', None)
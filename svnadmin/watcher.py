@@ -0,0 +1,277 @@
+# SVNAdmin plugin
+
+import os
+import os.path
+import time
+
+from trac.config import BoolOption, ChoiceOption, IntOption
+from trac.core import *
+from trac.util.text import exception_to_unicode
+from trac.versioncontrol import DbRepositoryProvider
+from trac.web.api import IRequestFilter
+
+from svnadmin.api import SvnAdmin, SvnRepositoryProvider
+from svnadmin.authz import SvnAuthzManager
+from svnadmin.util import BackgroundThread
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+# repositories created outside Trac are registered only after this many
+# seconds since they have appeared, so that Trac's own provisioning can
+# register them first
+REGISTER_DELAY = 30
+
+# directories which don't become repositories (no `format` file) within
+# this many seconds are not considered for registration any more
+PENDING_TIMEOUT = 600
+
+
+def _get_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+class SvnAdminWatcher(Component):
+    """Component watching the SVN parent directory, password file and
+    authz file in the background.
+
+    While the watcher runs, `SvnRepositoryProvider`, `SvnAdmin` and
+    `SvnAuthzManager` use their cached data without checking the file
+    system; the watcher invalidates only the entries affected by a
+    change. inotify (`pyinotify` module) is used when available,
+    otherwise the files are polled.
+    """
+
+    implements(IRequestFilter)
+
+    watch_mode = ChoiceOption('svnadmin', 'watch_mode',
+         ['off', 'auto', 'inotify', 'poll'],
+         'How to watch repositories, password and authz files for changes: '
+         '`inotify` requires pyinotify module, `poll` checks them every '
+         '`watch_interval` seconds, `auto` uses inotify when available. '
+         'With `off` files are checked on every access.')
+    watch_interval = IntOption('svnadmin', 'watch_interval', 5,
+         'Interval in seconds between checks of the polling watcher.')
+    auto_register = BoolOption('svnadmin', 'auto_register', 'false',
+         'Register repositories created in the parent directory outside '
+         'Trac (with project 0).')
+
+    def __init__(self):
+        self._thread = BackgroundThread('svnadmin-watcher', self._run,
+                                        self.log)
+        self._names = set()
+        self._pending = {}  # name waiting for registration -> seen time
+        self._stamps = {}  # polled path -> stamp
+
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        if self.watch_mode != 'off':
+            self._thread.start()
+        return handler
+
+    def post_process_request(self, req, template, data, content_type):
+        return template, data, content_type
+
+    # Internal methods
+
+    def _get_watched(self):
+        return (self.env[SvnRepositoryProvider], self.env[SvnAdmin],
+                self.env[SvnAuthzManager])
+
+    def _run(self):
+        use_inotify = self.watch_mode in ('auto', 'inotify')
+        if use_inotify and pyinotify is None:
+            if self.watch_mode == 'inotify':
+                self.log.warning('pyinotify module is not available, '
+                                 'polling for changes instead')
+            use_inotify = False
+        try:
+            self._invalidate_all()
+            if use_inotify:
+                self._watch_inotify()
+            else:
+                self._watch_poll()
+        except Exception, e:
+            self.log.error('SVNAdmin watcher failed: %s',
+                           exception_to_unicode(e, traceback=True))
+        finally:
+            for component in self._get_watched():
+                component.watched = False
+
+    def _invalidate_all(self):
+        provider, svnadmin, authz = self._get_watched()
+        provider.invalidate_cache()
+        for name in self._names:
+            provider.invalidate_cache(name)
+        svnadmin.invalidate_cache()
+        authz.invalidate_cache()
+        self._names = set(provider.get_repository_names())
+        for component in (provider, svnadmin, authz):
+            component.watched = True
+        if self.auto_register:
+            now = time.time()
+            self._pending = dict((name, now) for name in self._names)
+
+    # Change handlers
+
+    def _names_changed(self):
+        provider = self.env[SvnRepositoryProvider]
+        provider.invalidate_cache()
+        names = set(provider.get_repository_names())
+        for name in names ^ self._names:
+            provider.invalidate_cache(name)
+        if self.auto_register:
+            now = time.time()
+            for name in names - self._names:
+                self._pending[name] = now
+            for name in set(self._pending) - names:
+                del self._pending[name]
+        self._names = names
+
+    def _repository_changed(self, name):
+        self.env[SvnRepositoryProvider].invalidate_cache(name)
+
+    def _passwd_changed(self):
+        self.env[SvnAdmin].invalidate_cache()
+
+    def _authz_changed(self):
+        self.env[SvnAuthzManager].invalidate_cache()
+
+    def _register_pending(self):
+        """Register repositories created outside Trac."""
+        if not self._pending:
+            return
+        provider = self.env[SvnRepositoryProvider]
+        now = time.time()
+        due = []
+        for name, seen in self._pending.items():
+            # `format` is written when the repository is complete
+            if not os.path.exists(os.path.join(provider.parentpath, name,
+                                               'format')):
+                if now - seen >= PENDING_TIMEOUT:
+                    del self._pending[name]
+                continue
+            if now - seen >= REGISTER_DELAY:
+                due.append(name)
+        if not due:
+            return
+        # repositories being provisioned by Trac are registered by it
+        reserved = provider.get_reserved_names()
+        due = [name for name in due if name not in reserved]
+        db_provider = self.env[DbRepositoryProvider]
+        registered = set(name for name, info
+                         in db_provider.get_repositories())
+        added = sorted(name for name in due if name not in registered)
+        for name in due:
+            del self._pending[name]
+        if not added:
+            return
+        try:
+            provider.register_repositories([(name, 0) for name in added])
+        except Exception, e:
+            self.log.warning('Failed to register repositories %s: %s',
+                             ', '.join(added), exception_to_unicode(e))
+            return
+        self.log.info('Registered repositories created outside Trac: %s',
+                      ', '.join(added))
+
+    # Polling
+
+    def _watch_poll(self):
+        provider, svnadmin, authz = self._get_watched()
+        self._poll(provider, svnadmin, authz, initial=True)
+        while self.watch_mode != 'off' and \
+                self._thread.wait(max(1, self.watch_interval)):
+            self._poll(provider, svnadmin, authz)
+            self._register_pending()
+
+    def _poll(self, provider, svnadmin, authz, initial=False):
+        stamps = {}
+        def check(path, handler, *args):
+            stamp = stamps[path] = _get_stamp(path)
+            # paths seen for the first time (new repositories) are
+            # reported as changed too
+            if not initial and self._stamps.get(path, ()) != stamp:
+                handler(*args)
+        check(provider.parentpath, self._names_changed)
+        for name in self._names:
+            check(os.path.join(provider.parentpath, name, 'db', 'current'),
+                  self._repository_changed, name)
+        if svnadmin.passwd_path:
+            check(svnadmin.passwd_path, self._passwd_changed)
+        if authz.authz_file:
+            check(authz.authz_file, self._authz_changed)
+        self._stamps = stamps
+
+    # inotify
+
+    def _watch_inotify(self):
+        provider, svnadmin, authz = self._get_watched()
+        files_mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+                     pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE
+        names_mask = pyinotify.IN_CREATE | pyinotify.IN_DELETE | \
+                     pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO
+        current_mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO
+
+        parentpath = os.path.abspath(provider.parentpath)
+        files = {}  # watched file -> handler
+        if svnadmin.passwd_path:
+            files[os.path.abspath(svnadmin.passwd_path)] = \
+                    self._passwd_changed
+        if authz.authz_file:
+            files[os.path.abspath(authz.authz_file)] = self._authz_changed
+        repos_watches = {}  # repository db dir -> watch descriptor
+
+        dirs = {parentpath: names_mask}  # watched directory -> mask
+        for path in files:
+            dir = os.path.dirname(path)
+            dirs[dir] = dirs.get(dir, 0) | files_mask
+
+        wm = pyinotify.WatchManager()
+        def handle(event):
+            if event.mask & pyinotify.IN_Q_OVERFLOW:
+                self.log.warning('SVNAdmin watcher: inotify queue overflow')
+                self._invalidate_all()
+                return
+            if event.path == parentpath and event.dir and \
+                    not event.name.startswith('.'):
+                self._names_changed()
+            if event.pathname in files:
+                files[event.pathname]()
+            if event.name == 'current' and event.path in repos_watches:
+                self._repository_changed(
+                        os.path.basename(os.path.dirname(event.path)))
+        notifier = pyinotify.Notifier(wm, handle,
+                                      timeout=max(1, self.watch_interval)
+                                              * 1000)
+        try:
+            for dir, mask in dirs.iteritems():
+                wm.add_watch(dir, mask)
+            while self.watch_mode != 'off' and not self._thread.stopping:
+                # watch db directories of new repositories, forget
+                # removed ones (their watches are removed by the kernel)
+                dbs = set(os.path.join(parentpath, name, 'db')
+                          for name in self._names)
+                for dir in set(repos_watches) - dbs:
+                    del repos_watches[dir]
+                for dir in dbs - set(repos_watches):
+                    if os.path.isdir(dir):
+                        wd = wm.add_watch(dir, current_mask).get(dir, -1)
+                        if wd >= 0:
+                            repos_watches[dir] = wd
+                            self._repository_changed(
+                                    os.path.basename(os.path.dirname(dir)))
+                if notifier.check_events():
+                    notifier.read_events()
+                    notifier.process_events()
+                self._register_pending()
+        finally:
+            notifier.stop()